@@ -4,6 +4,18 @@
 import os
 import sys
 import argparse
+import glob
+import hashlib
+import shutil
+import tempfile
+import json
+import functools
+import inspect
+import time
+import struct
+import zlib
+import io
+from concurrent.futures import ThreadPoolExecutor, Future
 from pathlib import Path
 
 import numpy
@@ -13,6 +25,36 @@ t_FEMALE = 1
 t_MALE = 2
 t_LINE = 3
 
+# bump whenever split_image output changes for the same inputs, it is
+# part of the SplitCache key
+GENERATOR_VERSION = 2
+
+ARC_RATIO = 0.07
+CONNECT_RATIO = 0.3
+
+SPLIT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# pixels, small enough that the outline matches the fixed 300 samples
+FLATTEN_TOLERANCE = 0.1
+
+# Pillow's default, intermediate outputs can use 0 (stored) or 1 (fastest)
+PNG_COMPRESS_LEVEL = 6
+
+# sprite atlas sheets never grow beyond this many pixels per side
+ATLAS_MAX_SIZE = 8192
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+# streaming reads 8 bit non-interlaced PNGs of these color types (channels),
+# decoding at most this many rows at once
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+PNG_BAND_ROWS = 256
+
+OUTLINE_POLYLINE = "polyline"
+OUTLINE_ELLIPSE = "ellipse"
+OUTLINE_MODES = (OUTLINE_POLYLINE, OUTLINE_ELLIPSE)
+
 def computeBezierPoint(points, t):
     tSquared = t * t 
     tCubed = tSquared * t 
@@ -30,47 +72,69 @@ def computeBezierPoint(points, t):
 
     return (x,y)
 
+def computeBezierPoints(points, ts):
+    # Batched computeBezierPoint: evaluates every t at once and returns
+    # an (N, 2) array of curve points.
+    ts = numpy.asarray(ts, dtype=float)
+    x, y = computeBezierPoint(points, ts)
+    return numpy.column_stack((x, y))
+
+def flattenPointNum(points,tolerance,maxNum):
+    # Wang's formula: number of uniform segments that keeps a cubic curve
+    # within tolerance pixels of its polyline approximation.
+    p = numpy.asarray(points, dtype=float)
+    dd = numpy.linalg.norm(p[:-2] - 2 * p[1:-1] + p[2:], axis=1).max()
+    num = int(numpy.ceil(numpy.sqrt(0.75 * dd / tolerance)))
+    return min(max(num, 2), maxNum)
+
 def computerBezier(points,num):
     dt = 1.0/num
-    curvePoints = []
-
-    for i  in range(0,num) :
-        p = computeBezierPoint(points,dt * i )
-        curvePoints.append(p)
-
-    return curvePoints 
-
-
-def polygonCropImage(im,polygon,name):
-    imArray = numpy.asarray(im)
-
-    # create mask
-    #polygon = [(0,0),(0,200),(200,200)]
-    maskIm = Image.new('L', (imArray.shape[1], imArray.shape[0]), 0)
-    ImageDraw.Draw(maskIm).polygon(polygon, outline=1, fill=1)
-    mask = numpy.array(maskIm)
-    
-    # assemble new image (uint8: 0-255)
-    newImArray = numpy.empty(imArray.shape,dtype='uint8')
-    
-    # colors (three first columns, RGB)
-    newImArray[:,:,:3] = imArray[:,:,:3]
-    
-    # transparency (4th column)
-    newImArray[:,:,3] = mask*255
-    
-    # back to Image from numpy
-    newIm = Image.fromarray(newImArray, "RGBA")
-    newIm.save(name)
+    return computeBezierPoints(points, numpy.arange(num) * dt)
+
+
+def polygonCropImage(im,polygon,name=None,compressLevel=PNG_COMPRESS_LEVEL):
+    # im is the freshly cropped piece region, its alpha is replaced in place.
+    # The piece is saved to name when given and returned either way.
+    polygon = numpy.asarray(polygon)
+
+    # only rasterize the polygon's bounding box (clipped to the region)
+    left = max(int(numpy.floor(polygon[:,0].min())), 0)
+    top = max(int(numpy.floor(polygon[:,1].min())), 0)
+    right = min(int(numpy.ceil(polygon[:,0].max())) + 1, im.size[0])
+    bottom = min(int(numpy.ceil(polygon[:,1].max())) + 1, im.size[1])
+
+    mask = Image.new('L', im.size, 0)
+    if (left, top, right, bottom) == (0, 0) + im.size:
+        ImageDraw.Draw(mask).polygon(polygon.ravel().tolist(), outline=255, fill=255)
+    elif right > left and bottom > top:
+        boxMask = Image.new('L', (right - left, bottom - top), 0)
+        boxPolygon = (polygon - (left, top)).ravel().tolist()
+        ImageDraw.Draw(boxMask).polygon(boxPolygon, outline=255, fill=255)
+        mask.paste(boxMask, (left, top))
+
+    im.putalpha(mask)
+    if name is not None:
+        im.save(name,compress_level=compressLevel)
+    return im
     
 #we assume the (0,0) is at the center of the rectangle
 class PieceOutLine():
-    def __init__(self,width,height,ar,cr):
+    def __init__(self,width,height,ar,cr,tolerance=FLATTEN_TOLERANCE):
         self.w = width 
         self.h = height 
         self.arcRatio = ar
         self.connectRatio = cr
         self.pointNum = 300;
+        # max distance in pixels between a curve and its polyline, None
+        # (or 0) samples every curve with pointNum points
+        if tolerance is not None and tolerance < 0:
+            raise ValueError(f'Tolerance must not be negative: {tolerance}')
+        self.tolerance = tolerance or None
+
+    def curvePointNum(self,points):
+        if self.tolerance is None:
+            return self.pointNum
+        return flattenPointNum(points,self.tolerance,self.pointNum)
          
     def genRightFemaleArc(self,istop):
         halfW = self.w * 0.5
@@ -87,12 +151,12 @@ class PieceOutLine():
 
         curvPoints = [] 
         if not istop:
-            curvPoints = computerBezier(points, self.pointNum )
+            curvPoints = computerBezier(points, self.curvePointNum(points) )
         else:
             left = []
             for p in reversed(points):
                 left.append((p[0],-p[1]))
-            curvPoints = computerBezier(left, self.pointNum )
+            curvPoints = computerBezier(left, self.curvePointNum(left) )
 
         return curvPoints;
 
@@ -116,12 +180,12 @@ class PieceOutLine():
 
         curvPoints = [] 
         if not left:
-            curvPoints = computerBezier(points, self.pointNum )
+            curvPoints = computerBezier(points, self.curvePointNum(points) )
         else:
             left = []
             for p in reversed(points):
                 left.append((p[0],-p[1]))
-            curvPoints = computerBezier(left, self.pointNum )
+            curvPoints = computerBezier(left, self.curvePointNum(left) )
 
         return curvPoints
 
@@ -141,12 +205,12 @@ class PieceOutLine():
 
         curvPoints = [] 
         if not isLeft:
-            curvPoints = computerBezier(points, self.pointNum )
+            curvPoints = computerBezier(points, self.curvePointNum(points) )
         else:
             left = []
             for p in reversed(points):
                 left.append((-p[0],p[1]))
-            curvPoints = computerBezier(left, self.pointNum )
+            curvPoints = computerBezier(left, self.curvePointNum(left) )
 
         return curvPoints;
 
@@ -170,12 +234,12 @@ class PieceOutLine():
 
         curvPoints = [] 
         if not left:
-            curvPoints = computerBezier(points, self.pointNum )
+            curvPoints = computerBezier(points, self.curvePointNum(points) )
         else:
             left = []
             for p in reversed(points):
                 left.append((-p[0],p[1]))
-            curvPoints = computerBezier(left, self.pointNum )
+            curvPoints = computerBezier(left, self.curvePointNum(left) )
 
         return curvPoints
     
@@ -185,38 +249,35 @@ class PieceOutLine():
         left = self.genRightFemaleConnect(True) 
         leftArc = self.genRightFemaleArc(True) 
         
-        curvPoints = rightArc + right + left + leftArc
+        curvPoints = numpy.concatenate((rightArc, right, left, leftArc))
+        if self.tolerance is not None:
+            # curves stop short of t = 1, end the side exactly at its corner
+            curvPoints = numpy.concatenate((curvPoints, [ (self.w * 0.5, self.h * 0.5) ]))
         return curvPoints;
 
-    def genRightMale(self):
+    def genRightMale(self,female=None):
         halfW = self.w * 0.5
-        points = self.genRightFemale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append((p[0] + (halfW - p[0]) * 2, p[1]) )
+        curvPoints = self.genRightFemale() if female is None else female.copy()
+        curvPoints[:,0] = curvPoints[:,0] + (halfW - curvPoints[:,0]) * 2
         return curvPoints
     
     def genRightLine(self):
-        return [ ( self.w *0.5, self.h *0.5 ) ]
+        return numpy.array([ ( self.w *0.5, self.h *0.5 ) ])
 
-    def genLeftMale(self):
+    def genLeftMale(self,rightFemale=None):
         halfW = self.w * 0.5
-        points = self.genRightFemale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append( (p[0] - halfW * 2, p[1]) )
-        return reversed(curvPoints)
+        curvPoints = self.genRightFemale() if rightFemale is None else rightFemale.copy()
+        curvPoints[:,0] = curvPoints[:,0] - halfW * 2
+        return curvPoints[::-1]
 
-    def genLeftFemale(self):
+    def genLeftFemale(self,male=None):
         halfW = self.w * 0.5
-        points = self.genLeftMale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append(((-p[0] - halfW)*2 + p[0],p[1]))
+        curvPoints = self.genLeftMale() if male is None else male.copy()
+        curvPoints[:,0] = (-curvPoints[:,0] - halfW)*2 + curvPoints[:,0]
         return curvPoints
 
     def genLeftLine(self):
-        return [ ( -self.w*0.5, -self.h*0.5 ) ] 
+        return numpy.array([ ( -self.w*0.5, -self.h*0.5 ) ])
 
     def genBottomFemale(self):
         rightArc = self.genBottomFemaleArc(False) 
@@ -224,72 +285,91 @@ class PieceOutLine():
         left = self.genBottomFemaleConnect(True) 
         leftArc = self.genBottomFemaleArc(True) 
         
-        curvPoints = rightArc + right + left + leftArc
+        curvPoints = numpy.concatenate((rightArc, right, left, leftArc))
+        if self.tolerance is not None:
+            # curves stop short of t = 1, end the side exactly at its corner
+            curvPoints = numpy.concatenate((curvPoints, [ (-self.w * 0.5, self.h * 0.5) ]))
         return curvPoints;
 
-    def genBottomMale(self):
+    def genBottomMale(self,female=None):
         halfH = self.h * 0.5
-        points = self.genBottomFemale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append((p[0],(halfH - p[1])*2 + p[1] ))
+        curvPoints = self.genBottomFemale() if female is None else female.copy()
+        curvPoints[:,1] = (halfH - curvPoints[:,1])*2 + curvPoints[:,1]
         return curvPoints
 
     def genBottomLine(self):
-        return [ ( -self.w*0.5, self.h*0.5 ) ] 
+        return numpy.array([ ( -self.w*0.5, self.h*0.5 ) ])
 
-    def genTopMale(self):
-        points = self.genBottomFemale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append((p[0],p[1] - self.h))
+    def genTopMale(self,bottomFemale=None):
+        curvPoints = self.genBottomFemale() if bottomFemale is None else bottomFemale.copy()
+        curvPoints[:,1] = curvPoints[:,1] - self.h
 
-        return reversed(curvPoints)
+        return curvPoints[::-1]
 
-    def genTopFemale(self):
+    def genTopFemale(self,male=None):
         halfH = self.h * 0.5
-        points = self.genTopMale()
-        curvPoints = [] 
-        for p in points:
-            curvPoints.append((p[0],(-p[1] - halfH )*2 + p[1] ))
+        curvPoints = self.genTopMale() if male is None else male.copy()
+        curvPoints[:,1] = (-curvPoints[:,1] - halfH )*2 + curvPoints[:,1]
         return curvPoints
 
     def genTopLine(self):
-        return [ ( self.w*0.5, -self.h*0.5 ) ] 
+        return numpy.array([ ( self.w*0.5, -self.h*0.5 ) ])
     
-    def genOutLine(self,pieceBorders):
-        curvPoints = [ ] 
-        curvPoints.append((self.w * 0.5, self.h *0.5));
-        func = [ 
+    def genEdges(self):
+        # 4 sides x 3 border types, each female curve evaluated only once.
+        bottomFemale = self.genBottomFemale()
+        rightFemale = self.genRightFemale()
+        leftMale = self.genLeftMale(rightFemale)
+        topMale = self.genTopMale(bottomFemale)
+        edges = [ 
                 { 
-                    t_FEMALE:   self.genBottomFemale,
-                    t_MALE:     self.genBottomMale,
-                    t_LINE:     self.genBottomLine,
+                    t_FEMALE:   bottomFemale,
+                    t_MALE:     self.genBottomMale(bottomFemale),
+                    t_LINE:     self.genBottomLine(),
                 },
 
                 { 
-                    t_FEMALE:   self.genLeftFemale,
-                    t_MALE:     self.genLeftMale,
-                    t_LINE:     self.genLeftLine,
+                    t_FEMALE:   self.genLeftFemale(leftMale),
+                    t_MALE:     leftMale,
+                    t_LINE:     self.genLeftLine(),
                 },
                 { 
-                    t_FEMALE:   self.genTopFemale,
-                    t_MALE:     self.genTopMale,
-                    t_LINE:     self.genTopLine,
+                    t_FEMALE:   self.genTopFemale(topMale),
+                    t_MALE:     topMale,
+                    t_LINE:     self.genTopLine(),
                 },
                 { 
-                    t_FEMALE:   self.genRightFemale,
-                    t_MALE:     self.genRightMale,
-                    t_LINE:     self.genRightLine,
+                    t_FEMALE:   rightFemale,
+                    t_MALE:     self.genRightMale(rightFemale),
+                    t_LINE:     self.genRightLine(),
                 },
         ]
+        for side in edges:
+            for points in side.values():
+                points.setflags(write=False)
+        return edges
+
+    def genOutLine(self,pieceBorders):
+        curvPoints = [ numpy.array([ (self.w * 0.5, self.h *0.5) ]) ]
+        edges = cachedEdges(self.w,self.h,self.arcRatio,self.connectRatio,self.pointNum,self.tolerance)
         
         i =  0 
-        for f in func:
-            curvPoints += f[pieceBorders[i]]()
+        for side in edges:
+            curvPoints.append(side[pieceBorders[i]])
             i = i + 1 
 
-        return curvPoints
+        return numpy.concatenate(curvPoints)
+
+
+# Every piece of a grid shares the same geometry, and batch jobs often
+# repeat the same image size, so the edge templates are cached per geometry.
+EDGE_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=EDGE_CACHE_SIZE)
+def cachedEdges(width,height,ar,cr,pointNum,tolerance):
+    outLine = PieceOutLine(width,height,ar,cr,tolerance)
+    outLine.pointNum = pointNum
+    return outLine.genEdges()
 
 
 class PieceInfo():
@@ -371,96 +451,711 @@ class PieceInfo():
                 int(round(bottomY))
                 ),(centerX,centerY),borders
 
-def createPuzzlePieces(name,row,col,outPrefix):
-    im = Image.open(name).convert("RGBA")
-    arcRatio = 0.07
-    connectRatio = 0.3
+def drawOutline(draw,size,outLinePoints,r,mode=OUTLINE_POLYLINE,top=0,height=None):
+    # draw may cover a horizontal band of height rows of the image starting
+    # at row top, outLinePoints are then already relative to that band
+    if height is None:
+        height = size[1] - top
+    bgColor = (255,255,255,0)
+    lineColor = (0,0,0,255)
+
+    draw.rectangle( [ (0,0), (size[0],size[1]) ],fill = bgColor,outline = bgColor)
+
+    if mode == OUTLINE_POLYLINE:
+        # stroke every piece outline as one closed polyline, the width
+        # matches the footprint of the stamped ellipses. Pillow truncates wide
+        # line coordinates towards zero, floor them so outlines reaching
+        # above a band land on the same rows as on the whole image
+        for points in outLinePoints:
+            closed = numpy.floor(numpy.concatenate((points,points[:1])))
+            draw.line(closed.ravel().tolist(),fill=lineColor,width=2 * r + 1)
+        draw.rectangle( [ (0,-top), (size[0] - 1,size[1] - 1 - top) ],outline = lineColor,width = int(1.5 * r) + 1)
+        return
+
+    if mode != OUTLINE_ELLIPSE:
+        raise ValueError(f'Unknown outline mode: {mode}')
+
+    for p in numpy.concatenate(outLinePoints).tolist():
+        px = p[0]
+        py = p[1]
+        draw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor ,outline = lineColor)
+    
+    # only stamp the border ellipses that reach into the band
+    for py in (0.5 * r - top,size[1] - 0.5 * r - top):
+        if py + r < -1 or py - r > height + 1:
+            continue
+        for x in range(0,size[0]):
+            px = x
+            draw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
+    
+    for y in range(max(top - r - 1,0),min(top + height + r + 1,size[1])):
+        px = 0.5 * r
+        py = y - top
+        draw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
+        px = size[0] - 0.5 * r
+        draw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
+
+def writePngChunk(f,tag,data):
+    f.write(struct.pack(">I",len(data)))
+    f.write(tag)
+    f.write(data)
+    f.write(struct.pack(">I",zlib.crc32(data,zlib.crc32(tag))))
+
+class PngStreamWriter():
+    # Writes an RGBA PNG band by band, so the full image is never in memory.
+    def __init__(self,name,width,height,compressLevel=PNG_COMPRESS_LEVEL):
+        self.width = width
+        self.file = open(name,"wb")
+        self.compressor = zlib.compressobj(compressLevel)
+        self.file.write(PNG_SIGNATURE)
+        self.writeChunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,6,0,0,0))
+
+    def writeChunk(self,tag,data):
+        writePngChunk(self.file,tag,data)
+
+    def write(self,band):
+        pixels = numpy.asarray(band)
+        rows = numpy.zeros((pixels.shape[0],1 + self.width * 4),dtype=numpy.uint8)
+        rows[:,1:] = pixels.reshape(pixels.shape[0],-1)
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self.writeChunk(b"IDAT",data)
+
+    def close(self):
+        self.writeChunk(b"IDAT",self.compressor.flush())
+        self.writeChunk(b"IEND",b"")
+        self.file.close()
+
+class PngBandReader():
+    # Decodes a non-interlaced 8 bit PNG from the top down, only keeping the
+    # rows later bands still need in memory. The image data is inflated
+    # incrementally and Pillow unfilters it a few rows at a time, re-wrapped
+    # as a small PNG that starts with the last row decoded before them.
+    def __init__(self,name):
+        self.name = name
+        self.file = open(name,"rb")
+        self.headerChunks = []
+        self.idat = None
+        try:
+            if self.file.read(8) != PNG_SIGNATURE:
+                raise ValueError(f'Streaming only reads PNG images: {name}')
+            while self.idat is None:
+                tag,data = self.readChunk()
+                if tag == b"IHDR":
+                    self.header = data
+                elif tag in (b"PLTE",b"tRNS"):
+                    self.headerChunks.append((tag,data))
+                elif tag == b"IDAT":
+                    self.idat = data
+            width,height,bitDepth,colorType,_,_,interlace = struct.unpack(">IIBBBBB",self.header)
+            if bitDepth != 8 or interlace or colorType not in PNG_CHANNELS:
+                raise ValueError(f'Streaming only reads 8 bit non-interlaced PNG images: {name}')
+        except BaseException:
+            self.file.close()
+            raise
+        self.size = (width,height)
+        self.rowBytes = width * PNG_CHANNELS[colorType] + 1
+        self.inflater = zlib.decompressobj()
+        self.pending = b""
+        self.lastRow = None
+        self.nextRow = 0
+        # decoded (first row, RGBA rows) chunks from row keep on
+        self.chunks = []
+        self.keep = 0
+
+    def readChunk(self):
+        header = self.file.read(8)
+        if len(header) < 8:
+            raise ValueError(f'Truncated PNG image: {self.name}')
+        length,tag = struct.unpack(">I4s",header)
+        data = self.file.read(length)
+        self.file.read(4)
+        if tag == b"IEND" and self.idat is None:
+            raise ValueError(f'PNG image has no image data: {self.name}')
+        return tag,data
+
+    def nextData(self):
+        # the next IDAT chunk, b"" after the last one
+        data = self.idat or b""
+        if self.idat is not None:
+            tag,idat = self.readChunk()
+            self.idat = idat if tag == b"IDAT" else None
+        return data
+
+    def readFiltered(self,size):
+        parts = [self.pending[:size]]
+        have = len(parts[0])
+        self.pending = self.pending[size:]
+        while have < size:
+            data = self.inflater.unconsumed_tail or self.nextData()
+            if not data:
+                raise ValueError(f'Truncated PNG image: {self.name}')
+            part = self.inflater.decompress(data,size - have)
+            parts.append(part)
+            have += len(part)
+        return b"".join(parts)
+
+    def decodeRows(self,count):
+        # the next count rows, in the PNG's own mode
+        data = self.readFiltered(count * self.rowBytes)
+        rows = count
+        if self.lastRow is not None:
+            # the first row is unfiltered against the row before it
+            data = b"\0" + self.lastRow + data
+            rows += 1
+        png = io.BytesIO()
+        png.write(PNG_SIGNATURE)
+        writePngChunk(png,b"IHDR",struct.pack(">II",self.size[0],rows) + self.header[8:])
+        for tag,chunk in self.headerChunks:
+            writePngChunk(png,tag,chunk)
+        writePngChunk(png,b"IDAT",zlib.compress(data,0))
+        writePngChunk(png,b"IEND",b"")
+        png.seek(0)
+        im = Image.open(png)
+        im.load()
+        if self.lastRow is not None:
+            im = im.crop((0,1,self.size[0],rows))
+        self.lastRow = im.crop((0,count - 1,self.size[0],count)).tobytes()
+        self.nextRow += count
+        return im
+
+    def decodeLimit(self):
+        # rows decoded at once, each re-wrapped PNG stays within Pillow's
+        # decompression bomb limit, which would otherwise refuse a band of
+        # a very wide image
+        rows = PNG_BAND_ROWS
+        if Image.MAX_IMAGE_PIXELS:
+            rows = min(rows,Image.MAX_IMAGE_PIXELS // self.size[0] - 1)
+        return max(rows,1)
+
+    def crop(self,top,bottom,keep=None):
+        # RGBA rows top to bottom, transparent outside the image like
+        # Image.crop. Rows above keep (top by default) are dropped, later
+        # calls cannot ask for them again
+        keep = max(top if keep is None else keep,0)
+        if top < self.keep and self.keep > 0:
+            raise ValueError('PNG bands must be read from the top down')
+        end = min(bottom,self.size[1])
+        needed = max(min(top,keep),0)
+        while self.nextRow < end:
+            start = self.nextRow
+            stop = min(end,start + self.decodeLimit())
+            if start < needed:
+                # rows no band needs are decoded and dropped
+                stop = min(stop,needed)
+            rows = self.decodeRows(stop - start)
+            if stop > needed:
+                self.chunks.append((start,rows.convert("RGBA")))
+        band = Image.new("RGBA",(self.size[0],bottom - top))
+        for start,rows in self.chunks:
+            if start < bottom and start + rows.size[1] > top:
+                band.paste(rows,(0,start - top))
+        self.chunks = [ (start,rows) for start,rows in self.chunks if start + rows.size[1] > keep ]
+        self.keep = keep
+        return band
+
+    def close(self):
+        self.chunks = []
+        self.file.close()
+
+def writeOutlineBands(name,size,outLinePoints,row,col,r,mode,compressLevel=PNG_COMPRESS_LEVEL):
+    # Every band only draws the piece outlines whose bounding box reaches
+    # into it, tabs of wide pieces can cross more than one row.
+    writer = PngStreamWriter(name,size[0],size[1],compressLevel)
+    h = size[1]/row
+    margin = 2 * r + 2
+    spans = [ (p[:,1].min() - r - 1,p[:,1].max() + r + 1) for p in outLinePoints ]
+    try:
+        for i in range (0,row):
+            top = int(round(i * h))
+            bottom = size[1] if i + 1 == row else int(round((i + 1) * h))
+            # draw with a margin, Pillow clips strokes slightly differently
+            # right at the canvas edge
+            band = Image.new("RGBA",(size[0],bottom - top + 2 * margin))
+            points = [ 
+                    p - (0,top - margin)
+                    for p,(low,high) in zip(outLinePoints,spans)
+                    if high >= top - margin and low < bottom + margin
+                    ]
+            drawOutline(ImageDraw.Draw(band),size,points,r,mode,top - margin,band.size[1])
+            writer.write(band.crop((0,margin,size[0],margin + bottom - top)))
+    finally:
+        writer.close()
+
+class PieceAtlas():
+    # Packs pieces row by row into shelves on one or more RGBA sheets.
+    def __init__(self,maxSize=ATLAS_MAX_SIZE):
+        self.maxSize = maxSize
+        self.sheetSizes = []
+        self.sheets = []
+        self.slots = {}
+        self.shelfX = maxSize
+        self.shelfY = 0
+        self.shelfH = 0
+
+    def place(self,name,w,h):
+        if w > self.maxSize or h > self.maxSize:
+            # a piece larger than a sheet gets a sheet of its own, the next
+            # piece starts a new one
+            self.sheetSizes.append([w,h])
+            self.slots[name] = (len(self.sheetSizes) - 1,0,0,w,h)
+            self.shelfX = self.maxSize
+            self.shelfY = self.maxSize
+            self.shelfH = 0
+            return
+        if self.shelfX + w > self.maxSize:
+            # start a new shelf, or a new sheet when it would not fit
+            self.shelfY += self.shelfH
+            self.shelfX = 0
+            self.shelfH = 0
+        if not self.sheetSizes or self.shelfY + h > self.maxSize:
+            self.sheetSizes.append([0,0])
+            self.shelfX = 0
+            self.shelfY = 0
+            self.shelfH = 0
+        sheet = len(self.sheetSizes) - 1
+        self.slots[name] = (sheet,self.shelfX,self.shelfY,w,h)
+        self.shelfX += w
+        self.shelfH = max(self.shelfH,h)
+        size = self.sheetSizes[sheet]
+        size[0] = max(size[0],self.shelfX)
+        size[1] = max(size[1],self.shelfY + h)
+
+    def paste(self,name,piece):
+        if not self.sheets:
+            self.sheets = [ Image.new("RGBA",tuple(size)) for size in self.sheetSizes ]
+        sheet,x,y,w,h = self.slots[name]
+        self.sheets[sheet].paste(piece,(x,y))
+
+    def save(self,outPrefix,offsets,compressLevel=PNG_COMPRESS_LEVEL):
+        sheetNames = []
+        for i in range(0,len(self.sheets)):
+            sheetNames.append(os.path.basename(outPrefix) + "atlas_" + str(i) + ".png")
+            self.sheets[i].save(outPrefix + "atlas_" + str(i) + ".png",compress_level=compressLevel)
+        pieces = {}
+        for name,(sheet,x,y,w,h) in self.slots.items():
+            pieces[name] = { "sheet": sheet, "rect": [x,y,w,h], "offset": offsets[name] }
+        with open(outPrefix + "atlas.json","w") as f:
+            json.dump({ "sheets": sheetNames, "pieces": pieces },f,indent=4)
+
+def extractPiece(im,rect,cropPoints,name,compressLevel=PNG_COMPRESS_LEVEL):
+    # the piece is only returned for the atlas (name is None), a piece saved
+    # to its own file is not kept around
+    piece = polygonCropImage(im.crop(rect),cropPoints,name,compressLevel)
+    return piece if name is None else None
+
+def collectPieces(pieces,atlas):
+    # pieces are (name, image or future) pairs, only needed for the atlas
+    for name,piece in pieces:
+        if isinstance(piece,Future):
+            piece = piece.result()
+        if atlas is not None:
+            atlas.paste(name,piece)
+
+def createPuzzlePieces(name,row,col,outPrefix,outlineMode=OUTLINE_POLYLINE,jobs=1,tolerance=FLATTEN_TOLERANCE,
+                       streaming=False,atlas=False,compressLevel=PNG_COMPRESS_LEVEL,
+                       arcRatio=ARC_RATIO,connectRatio=CONNECT_RATIO,executor=None):
+    piecesStart = time.perf_counter()
+    if streaming and atlas:
+        # the atlas would hold every piece in memory again
+        raise ValueError('Streaming writes each piece to its own file, it cannot build an atlas')
+    if streaming:
+        # never decodes the whole image, so Pillow's MAX_IMAGE_PIXELS check
+        # is applied to the decoded bands rather than to the full image
+        im = PngBandReader(name)
+    else:
+        im = Image.open(name).convert("RGBA")
     r = 3
 
+    if outlineMode == OUTLINE_ELLIPSE:
+        # stamped ellipses only join up on densely sampled curves
+        tolerance = None
+
     info = PieceInfo(im.size,row,col,arcRatio,connectRatio)
 
-    outLine = PieceOutLine(im.size[0]/col,im.size[1]/row,arcRatio,connectRatio)
+    outLine = PieceOutLine(im.size[0]/col,im.size[1]/row,arcRatio,connectRatio,tolerance)
     
     w =im.size[0]/col
     h = im.size[1]/row
 
-    draw = ImageDraw.Draw(im)
+    # Pillow releases the GIL while cropping, rasterizing and PNG encoding,
+    # so a thread pool keeps every core busy without pickling the image.
+    # A batch passes its own executor, shared by all of its images.
+    ownExecutor = executor is None
+    if ownExecutor:
+        jobs = jobs or os.cpu_count()
+        executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    futures = []
+
+    pieceAtlas = None
+    if atlas:
+        # lay the sheets out up front so pieces can be pasted as they come
+        pieceAtlas = PieceAtlas()
+        for i in range (0,row):
+            for j in range (0,col):
+                rect = info.getPieceInfo(i,j)[0]
+                pieceAtlas.place("piece_" + str(i) + "_" + str(j),rect[2] - rect[0],rect[3] - rect[1])
+    offsets = {}
+
     outLinePoints = [] 
     json="{"
     first = True
-    for i in range (0,row):
-        for j in range (0,col):
-            rect,center,borders = info.getPieceInfo(i,j)
-            name = outPrefix + str(i) + "_" + str(j)
-            if not first:
-                json +=","
-            first = False
-
-            json +="\n    \"" + os.path.basename(name) + "\":[" + str(rect[0]) + "," + str(rect[1]) + "]" 
-            region = im.crop(rect)
-            curvPoints = outLine.genOutLine(borders) 
-
-            cropPoints = [] 
-            for p in curvPoints:
-                cropPoints.append((p[0] + center[0],p[1] + center[1]))
-            polygonCropImage(region,cropPoints,name + ".png");
-            
-            for p in curvPoints:
-                outLinePoints.append((p[0] + j * w  + 0.5 * w ,p[1] + i * h + 0.5 * h))
-    
+    if streaming:
+        # the tabs of wide pieces reach above the row before them, a row's
+        # band keeps every row a later band still needs
+        tops = [ min(info.getPieceInfo(i,j)[0][1] for j in range (0,col)) for i in range (0,row) ]
+        keeps = [ min(tops[i + 1:],default=tops[i]) for i in range (0,row) ]
+
+    try:
+        for i in range (0,row):
+            pieces = [ info.getPieceInfo(i,j) for j in range (0,col) ]
+            region = im
+            regionTop = 0
+            if streaming:
+                # only convert the rows the pieces of this row cover
+                regionTop = min(rect[1] for rect,center,borders in pieces)
+                regionBottom = max(rect[3] for rect,center,borders in pieces)
+                region = im.crop(regionTop,regionBottom,keeps[i])
+
+            for j in range (0,col):
+                rect,center,borders = pieces[j]
+                name = outPrefix + str(i) + "_" + str(j)
+                if not first:
+                    json +=","
+                first = False
+
+                json +="\n    \"" + os.path.basename(name) + "\":[" + str(rect[0]) + "," + str(rect[1]) + "]" 
+                offsets["piece_" + str(i) + "_" + str(j)] = [rect[0],rect[1]]
+                curvPoints = outLine.genOutLine(borders) 
+
+                cropPoints = curvPoints + center
+                regionRect = (rect[0],rect[1] - regionTop,rect[2],rect[3] - regionTop)
+                pieceName = None if atlas else name + ".png"
+                if executor is None:
+                    piece = extractPiece(region,regionRect,cropPoints,pieceName,compressLevel)
+                else:
+                    piece = executor.submit(extractPiece,region,regionRect,cropPoints,pieceName,compressLevel)
+                futures.append(("piece_" + str(i) + "_" + str(j),piece))
+                
+                outLinePoints.append(curvPoints + (j * w  + 0.5 * w, i * h + 0.5 * h))
+
+            # release the row's region before converting the next one
+            if streaming or executor is None:
+                collectPieces(futures,pieceAtlas)
+                futures = []
+            else:
+                # paste the pieces cut so far, only keep the ones in flight
+                pending = []
+                for pieceName,piece in futures:
+                    if piece.done():
+                        collectPieces([(pieceName,piece)],pieceAtlas)
+                    else:
+                        pending.append((pieceName,piece))
+                futures = pending
+        
+        # the outline is drawn over im, so every piece must be cut first
+        collectPieces(futures,pieceAtlas)
+    finally:
+        if streaming:
+            im.close()
+        if ownExecutor and executor is not None:
+            executor.shutdown(cancel_futures=True)
+        else:
+            for pieceName,piece in futures:
+                if isinstance(piece,Future):
+                    piece.cancel()
+
     json +="\n}\n"
     dataFile = open(outPrefix + "data.json" ,"w"); 
     dataFile.write(json)
     dataFile.flush()
     dataFile.close()
 
-    bgColor = (255,255,255,0)
-    lineColor = (0,0,0,255)
-
-    outLinedraw = ImageDraw.Draw(im)
-
-    outLinedraw.rectangle( [ (0,0), (im.size[0],im.size[1]) ],fill = bgColor,outline = bgColor)
-
-    for p in outLinePoints:
-        px = p[0]
-        py = p[1]
-        outLinedraw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor ,outline = lineColor)
-    
-    for x in range(0,im.size[0]):
-        px = x
-        py = 0.5 * r
-        outLinedraw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
-        py = im.size[1] - 0.5 * r
-        outLinedraw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
-    
-    for y in range(0,im.size[1]):
-        px = 0.5 * r
-        py = y
-        outLinedraw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
-        px = im.size[0] - 0.5 * r
-        outLinedraw.ellipse( (px - r, py - r, px + r, py + r ), fill=lineColor,outline = lineColor)
-
-    im.save(outPrefix + "outline.png");
-
-
-def split_image(image_path, rows, columns, output_dir, ):
+    if pieceAtlas is not None:
+        pieceAtlas.save(outPrefix,offsets,compressLevel)
+
+    outlineStart = time.perf_counter()
+    if streaming:
+        size = im.size
+        writeOutlineBands(outPrefix + "outline.png",size,outLinePoints,row,col,r,outlineMode,compressLevel)
+    else:
+        outLinedraw = ImageDraw.Draw(im)
+        drawOutline(outLinedraw,im.size,outLinePoints,r,outlineMode)
+        im.save(outPrefix + "outline.png",compress_level=compressLevel);
+
+    return { 
+            "pieces": outlineStart - piecesStart,
+            "outline": time.perf_counter() - outlineStart,
+            }
+
+
+def split_image(image_path, rows, columns, output_dir, outline_mode=OUTLINE_POLYLINE, jobs=1,
+                tolerance=FLATTEN_TOLERANCE, streaming=False, atlas=False,
+                compress_level=PNG_COMPRESS_LEVEL, arc_ratio=ARC_RATIO, connect_ratio=CONNECT_RATIO,
+                executor=None):
+    """Split an image into pieces, returns the time spent per stage in seconds."""
     if not os.path.exists(output_dir) :
         os.makedirs(output_dir)
     
     outPrefix = output_dir + "/piece_"
-    createPuzzlePieces(image_path, rows, columns, outPrefix)
+    return createPuzzlePieces(image_path, rows, columns, outPrefix, outlineMode=outline_mode, jobs=jobs,
+                              tolerance=tolerance, streaming=streaming, atlas=atlas,
+                              compressLevel=compress_level, arcRatio=arc_ratio,
+                              connectRatio=connect_ratio, executor=executor)
+
+# (width, height, rows, columns) of the images check_streaming splits, wide
+# and tall pieces have tabs that cross more than one row of pieces
+STREAMING_CHECK_CASES = ((2000, 300, 6, 2), (3000, 400, 8, 2), (300, 2000, 2, 6), (1550, 880, 4, 4))
+
+def check_streaming(cases=STREAMING_CHECK_CASES, outline_modes=OUTLINE_MODES):
+    """Split noise images with and without streaming, returns the outputs that differ.
+
+    A regression check that streamed pieces and outlines match the normal
+    ones pixel for pixel, run by --check-streaming.
+    """
+    rng = numpy.random.default_rng(0)
+    mismatches = []
+    with tempfile.TemporaryDirectory() as work:
+        for width, height, rows, columns in cases:
+            image_path = os.path.join(work, f"{width}x{height}.png")
+            Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=numpy.uint8)).save(image_path)
+            for mode in outline_modes:
+                outputs = [os.path.join(work, f"{width}x{height}_{mode}_{streaming}") for streaming in (False, True)]
+                for output, streaming in zip(outputs, (False, True)):
+                    split_image(image_path, rows, columns, output, outline_mode=mode, streaming=streaming)
+                for name in sorted(os.listdir(outputs[0])):
+                    if not name.endswith(".png"):
+                        continue
+                    normal, streamed = (numpy.asarray(Image.open(os.path.join(output, name)).convert("RGBA"))
+                                        for output in outputs)
+                    if normal.shape != streamed.shape or (normal != streamed).any():
+                        mismatches.append(f"{width}x{height} {rows}x{columns} {mode}: {name}")
+    return mismatches
+
+def find_batch_images(source):
+    """Resolve a batch source to image paths.
+
+    source is a directory (all images in it), an existing manifest file (a
+    JSON list or one path per line, relative to the manifest) or a glob.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        )
+    if os.path.isfile(source):
+        with open(source) as f:
+            if source.endswith(".json"):
+                paths = json.load(f)
+            else:
+                paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        base = os.path.dirname(os.path.abspath(source))
+        return [os.path.join(base, path) for path in paths]
+    return sorted(glob.glob(source))
+
+def split_images(image_paths, rows, columns, output_dir, jobs=1, **options):
+    """Split many images with one shared worker pool.
+
+    Every image is written to output_dir/<image name>. Outline templates are
+    cached per geometry, so images of the same size and grid reuse them.
+    Failures do not stop the batch, yields (image_path, output, timings,
+    error) for every image as it completes.
+    """
+    jobs = jobs or os.cpu_count()
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    used = set()
+    try:
+        for image_path in image_paths:
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            output = os.path.join(output_dir, name)
+            suffix = 1
+            while output in used:
+                output = os.path.join(output_dir, f"{name}_{suffix}")
+                suffix += 1
+            used.add(output)
+
+            start = time.perf_counter()
+            try:
+                timings = split_image(image_path, rows, columns, output, executor=executor, **options)
+            except Exception as e:
+                yield image_path, output, None, e
+                continue
+            timings["total"] = time.perf_counter() - start
+            yield image_path, output, timings, None
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+class SplitCache():
+    """On-disk cache of split_image results.
+
+    Entries are keyed on the image content hash, the grid, the split options
+    and GENERATOR_VERSION. The least recently used entries are evicted once
+    the cache grows beyond max_bytes. With max_bytes None nothing is
+    evicted, worker processes sharing the cache open it that way and their
+    parent evicts once none of them reads an entry any more.
+    """
+
+    def __init__(self, cache_dir, max_bytes=SPLIT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image_path, rows, columns, **options):
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        # fill in split_image's defaults, so leaving an option out and
+        # passing its default value share an entry
+        for name, param in inspect.signature(split_image).parameters.items():
+            if param.default is not inspect.Parameter.empty and name not in ("jobs", "streaming", "executor"):
+                options.setdefault(name, param.default)
+        # 0 and None both sample every curve with a fixed number of points
+        options["tolerance"] = options["tolerance"] or None
+        params = dict(options, rows=rows, columns=columns, version=GENERATOR_VERSION)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def split(self, image_path, rows, columns, **options):
+        """Return a directory holding the split_image output, splitting on a miss."""
+        # neither changes the output
+        options.pop("jobs", None)
+        options.pop("streaming", None)
+        entry = os.path.join(self.cache_dir, self.key(image_path, rows, columns, **options))
+        if os.path.isdir(entry):
+            self.hits += 1
+            os.utime(entry)
+            return entry
+
+        self.misses += 1
+        # split next to the entry and rename, readers never see a partial entry
+        tmp_dir = tempfile.mkdtemp(prefix=".split-", dir=self.cache_dir)
+        try:
+            split_image(image_path, rows, columns, tmp_dir, **options)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            if not os.path.isdir(entry):
+                raise
+            # another process stored the same entry first
+            shutil.rmtree(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir)
+            raise
+        self.evict(keep=entry)
+        return entry
+
+    def entries(self):
+        """Return (mtime, size, path) for every entry, oldest first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+            entries.append((os.stat(path).st_mtime, size, path))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+def load_atlas(output_dir):
+    """Load the pieces written by split_image(atlas=True).
+
+    Every sheet is decoded once, returns a dict of piece name to
+    (RGBA numpy array, [x, y] offset).
+    """
+    with open(os.path.join(output_dir, "piece_atlas.json")) as f:
+        index = json.load(f)
+    sheets = [numpy.asarray(Image.open(os.path.join(output_dir, name)).convert("RGBA"))
+              for name in index["sheets"]]
+    pieces = {}
+    for name, entry in index["pieces"].items():
+        x, y, w, h = entry["rect"]
+        pieces[name] = (sheets[entry["sheet"]][y:y + h, x:x + w], entry["offset"])
+    return pieces
 
 def main():
     parser = argparse.ArgumentParser(description='Split an image into puzzle pieces')
-    parser.add_argument('--image', required=True, help='Path to the input image')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help='Path to the input image')
+    source.add_argument('--batch', help='Directory, glob or manifest file of images to split, '
+                                        'each into its own directory under --output')
+    source.add_argument('--check-streaming', action='store_true',
+                        help='Check that --streaming output matches the normal output on extreme aspect ratios')
     parser.add_argument('--rows', type=int, default=4, help='Number of rows')
     parser.add_argument('--columns', type=int, default=4, help='Number of columns')
     parser.add_argument('--output', default='puzzle_pieces', help='Output directory')
+    parser.add_argument('--outline-mode', choices=OUTLINE_MODES, default=OUTLINE_POLYLINE,
+                        help='Outline renderer: stroked polylines (fast) or stamped ellipses (legacy)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of threads extracting pieces in parallel (0 = one per CPU)')
+    parser.add_argument('--tolerance', type=float, default=FLATTEN_TOLERANCE,
+                        help='Max curve flattening error in pixels (0 = fixed 300 points per curve)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Read and process one row of pieces at a time to bound memory on very large '
+                             'images (8 bit PNG input, not with --atlas)')
+    parser.add_argument('--atlas', action='store_true',
+                        help='Pack all pieces into sprite sheets indexed by piece_atlas.json')
+    parser.add_argument('--compress-level', type=int, choices=range(0, 10), default=PNG_COMPRESS_LEVEL,
+                        help='PNG compression level, 0 (stored) to 9 (smallest)')
     
     args = parser.parse_args()
+    options = dict(outline_mode=args.outline_mode, tolerance=args.tolerance or None,
+                   streaming=args.streaming, atlas=args.atlas, compress_level=args.compress_level)
+
+    if args.check_streaming:
+        mismatches = check_streaming()
+        for mismatch in mismatches:
+            print(f'Streamed output differs: {mismatch}')
+        print(f'{len(mismatches)} streamed outputs differ')
+        return 1 if mismatches else 0
+
+    if args.batch:
+        image_paths = find_batch_images(args.batch)
+        if not image_paths:
+            print(f'Error: no images found for {args.batch}')
+            return 1
+        failures = 0
+        batchStart = time.perf_counter()
+        for image_path, output, timings, error in split_images(image_paths, args.rows, args.columns,
+                                                               args.output, jobs=args.jobs, **options):
+            if error is not None:
+                failures += 1
+                print(f'{image_path}: Error: {str(error)}')
+                continue
+            print(f'{image_path}: {timings["total"]:.2f}s (pieces {timings["pieces"]:.2f}s, '
+                  f'outline {timings["outline"]:.2f}s) -> {output}')
+        print(f'\nSplit {len(image_paths) - failures}/{len(image_paths)} images '
+              f'in {time.perf_counter() - batchStart:.2f}s')
+        return 1 if failures else 0
     
     try:
-        split_image(args.image, args.rows, args.columns, args.output)
+        timings = split_image(args.image, args.rows, args.columns, args.output,
+                              jobs=args.jobs, **options)
+        print(f'Pieces extracted in {timings["pieces"]:.2f}s')
+        print(f'Outline rendered in {timings["outline"]:.2f}s')
         print(f'\nPuzzle pieces have been generated in: {args.output}')
     except Exception as e:
         print(f'Error: {str(e)}')
@@ -19,24 +19,98 @@ $ PYTHONPATH=. python templates/jigsawreveal.py --input-dir /path/to/assets --ou
 """
 
 import os
+import queue
+import importlib
+import multiprocessing
 import shutil
 import tempfile
 import json
 import argparse
+import time
+import subprocess
+import wave
+import hashlib
+import bisect
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
+from PIL import Image
 from moviepy import (
     ImageClip, TextClip, CompositeVideoClip, 
     CompositeAudioClip,
-    AudioFileClip, VideoFileClip,
+    AudioFileClip, VideoFileClip, VideoClip, AudioArrayClip,
     concatenate_videoclips, vfx, afx
 )
 
-from utils import get_asset_path
-from jigsaw_puzzle_asset_generator import split_image
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from moviepy.tools import compute_position
+from proglog import default_bar_logger
+
+from utils import get_asset_path, invalidate_asset_index, AssetCache, QueueProgressLogger
+from jigsaw_puzzle_asset_generator import split_image, load_atlas, SplitCache, GENERATOR_VERSION
 
 CANVA_WIDTH = 1920
 CANVA_HEIGHT = 1080
 FPS = 24
+PUZZLE_POSITION = (231, 162)
+# Size the source image is resized to before it is split, so the puzzle
+# fills the frame whatever the image's own resolution. Images of another
+# aspect ratio are scaled to fit inside it and keep their aspect ratio
+PUZZLE_SIZE = (1550, 880)
+# Page timeline, in seconds
+PAGE_DURATION = 3
+FADE_DURATION = 1
+LAST_PAGE_EXTRA = 3
+STING_DURATION = 1.5
+STING_ASSET = "guitar-string-fade-out-332451.mp3"
+# Config keys of batched reveals: pieces_per_page pieces fade in together on
+# each page, or duration (seconds) sets the pieces per page and stretches the
+# pages so the clip lasts about that long. Pages never get shorter than
+# PAGE_DURATION and the last page always lasts PAGE_DURATION + LAST_PAGE_EXTRA
+PIECES_PER_PAGE = 1
+# Background music mixed under the whole video
+BGM_VOLUME = 0.33
+BGM_FADE_DURATION = 2
+SAMPLE_FPS = 44100
+CONFETTI_DURATION = 2
+SUBSCRIBE_SIZE = (379, 147)
+SUBSCRIBE_POSITION = (1498, 52)
+TEXT_POSITION = ("center", 714)
+# x264 settings of each encoding profile. Keyframes are spaced gop seconds
+# apart, threads 0 lets x264 pick. Only the draft profile tunes for still
+# images, the overlay GIFs animate on every page
+ENCODING_PROFILES = {
+    "draft": dict(preset="ultrafast", crf=30, tune="stillimage", gop=10, pix_fmt="yuv420p", threads=0),
+    "web": dict(preset="medium", crf=23, tune=None, gop=2, pix_fmt="yuv420p", threads=0),
+    "archive": dict(preset="slow", crf=16, tune=None, gop=10, pix_fmt="yuv444p", threads=0),
+}
+DEFAULT_PROFILE = "web"
+# Draft renders: the same timeline at a fraction of the resolution and fps,
+# encoded with the draft profile
+DRAFT_SCALE = 0.5
+DRAFT_FPS = 12
+DRAFT_PROFILE = "draft"
+# Render engines of make_jigsaw_clip: MoviePy compositing, or NumPy frames
+# piped straight to ffmpeg
+ENGINE_MOVIEPY = "moviepy"
+ENGINE_NUMPY = "numpy"
+ENGINES = (ENGINE_MOVIEPY, ENGINE_NUMPY)
+# Bump when a change makes make_jigsaw_clip render clips differently, so
+# ClipCache stops reusing clips rendered before it
+RENDERER_VERSION = 5
+CLIP_CACHE_MAX_BYTES = 8 * 1024 ** 3
+# Assets every clip renders besides its own background and image
+CLIP_ASSETS = ("Frame.png", "Subscribe2.gif", "Confetti.gif", "Super_Adorable.ttf", STING_ASSET)
+# How generate_jigsaw_video joins rendered clips: decode and re-encode the
+# whole sequence, or concatenate the encoded streams as they are
+JOIN_REENCODE = "reencode"
+JOIN_COPY = "copy"
+JOIN_MODES = (JOIN_REENCODE, JOIN_COPY)
+
+# Decoded GIF frames, sounds and resized images shared by every page and clip
+ASSET_CACHE = AssetCache()
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Jigsaw Puzzle Video Generator')
@@ -48,95 +122,692 @@ def parse_args():
     parser.add_argument('--intro', type=str, help='Intro mp4 file to prepend', default=None)
     parser.add_argument('--outtro', type=str, help='Outtro mp4 file to append', default=None)
     parser.add_argument('--bgm', type=str, help='Background music mp3 file to loop', default=None)
+    parser.add_argument('--split-cache', type=str, help='Directory to cache split puzzle pieces in', default=None)
+    parser.add_argument('--clip-cache', type=str, default=None,
+                        help='Directory to cache rendered clips in, only changed clips are re-rendered')
+    parser.add_argument('--join', type=str, choices=JOIN_MODES, default=JOIN_REENCODE,
+                        help='Re-encode the joined clips, or copy their streams without re-encoding')
+    parser.add_argument('--workers', type=int, default=1, help='Number of clips to render in parallel processes')
+    parser.add_argument('--draft', action='store_true',
+                        help=f'Fast preview at {DRAFT_SCALE:g}x resolution and at most {DRAFT_FPS} fps')
+    parser.add_argument('--profile', type=str, choices=ENCODING_PROFILES, default=None,
+                        help=f'Encoding profile (default: {DEFAULT_PROFILE}, {DRAFT_PROFILE} with --draft)')
+    parser.add_argument('--segments', type=int, default=1,
+                        help='Render each clip as this many time segments in parallel processes')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Build each page just before it is rendered to keep memory flat on large grids')
+    parser.add_argument('--engine', type=str, choices=ENGINES, default=ENGINE_MOVIEPY,
+                        help='Composite frames with MoviePy, or blend them with NumPy and pipe them to ffmpeg')
     return parser.parse_args()
 
+def encoder_options(profile, fps):
+    """write_videofile options of an encoding profile."""
+    settings = ENCODING_PROFILES[profile]
+    gop = max(1, int(round(settings['gop'] * fps)))
+    params = ["-crf", str(settings['crf']), "-g", str(gop)]
+    if settings['tune']:
+        params += ["-tune", settings['tune']]
+    return dict(
+        codec="libx264",
+        preset=settings['preset'],
+        pixel_format=settings['pix_fmt'],
+        threads=settings['threads'] or None,
+        ffmpeg_params=params,
+    )
+
+def encoder_args(profile, fps):
+    """ffmpeg video output arguments of an encoding profile."""
+    options = encoder_options(profile, fps)
+    args = ["-c:v", options['codec'], "-preset", options['preset'],
+            "-pix_fmt", options['pixel_format'], *options['ffmpeg_params']]
+    if options['threads']:
+        args += ["-threads", str(options['threads'])]
+    return args
+
+def report_encode(path, n_frames, seconds, profile):
+    """Print the measured encode throughput of a written video."""
+    print(f"Encoded {os.path.basename(path)}: {n_frames} frames in {seconds:.1f}s, "
+          f"{n_frames / max(seconds, 1e-9):.1f} fps ({profile} profile)")
+
+def scaled(value, scale=1.0):
+    """Scale a length, or the lengths of a position or size, of the full size layout.
+
+    Named positions such as "center" are kept as they are.
+    """
+    if isinstance(value, tuple):
+        return tuple(scaled(v, scale) for v in value)
+    if isinstance(value, str) or scale == 1:
+        return value
+    return int(round(value * scale))
+
+def fit_image(image_path, size, work_dir):
+    """Path of the image scaled to fit inside size, written to work_dir
+    unless it has the fitted size already.
+
+    The aspect ratio is kept and nothing is cropped or padded, an image of
+    another aspect ratio comes out narrower or shorter than size.
+    """
+    with Image.open(image_path) as image:
+        factor = min(size[0] / image.width, size[1] / image.height)
+        fitted = (min(max(round(image.width * factor), 1), size[0]),
+                  min(max(round(image.height * factor), 1), size[1]))
+        if image.size == fitted:
+            return image_path
+        scaled_path = os.path.join(work_dir, "scaled_" + os.path.basename(image_path) + ".png")
+        image.resize(fitted, Image.Resampling.LANCZOS).save(scaled_path)
+    return scaled_path
+
+def load_image(path, size=None):
+    """RGBA array of an image, resized to size, decoded once per run."""
+    def decode():
+        image = Image.open(path).convert('RGBA')
+        if size is not None:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        return np.asarray(image)
+    return ASSET_CACHE.get(path, ('image', size), decode)
+
+def load_overlay(path, size=None, decode_duration=None):
+    """RGBA frames and fps of an animated overlay (GIF), decoded once per run.
+
+    Only the first decode_duration seconds are decoded when given.
+    """
+    def decode():
+        clip = VideoFileClip(path, has_mask=True)
+        try:
+            if size is not None:
+                clip = clip.resized(size)
+            count = clip.reader.n_frames
+            if decode_duration is not None:
+                count = min(count, int(clip.fps * decode_duration) + 1)
+            frames = np.empty((count, clip.h, clip.w, 4), dtype=np.uint8)
+            for i in range(count):
+                t = i / clip.fps
+                frames[i, :, :, :3] = clip.get_frame(t)
+                frames[i, :, :, 3] = np.round(clip.mask.get_frame(t) * 255)
+            return frames, clip.fps
+        finally:
+            clip.close()
+
+    return ASSET_CACHE.get(path, ('overlay', size, decode_duration), decode)
+
+def overlay_index(frames, fps, t):
+    """Frame of an overlay shown at t, the last one repeating past the end
+    like VideoFileClip does."""
+    return min(int(fps * t + 0.00001), len(frames) - 1)
+
+def overlay_clip(path, duration, size=None, decode_duration=None):
+    """Animated overlay (GIF) clip with its mask, decoded once per run."""
+    frames, fps = load_overlay(path, size, decode_duration)
+    index = lambda t: overlay_index(frames, fps, t)
+    mask = VideoClip(lambda t: frames[index(t)][:, :, 3] / 255.0, is_mask=True, duration=duration)
+    return VideoClip(lambda t: frames[index(t)][:, :, :3], duration=duration).with_mask(mask)
+
+def load_sound(path, fps=SAMPLE_FPS):
+    """PCM samples at fps and fps of a sound file, decoded once per run."""
+    def decode():
+        with AudioFileClip(path, fps=fps) as audio:
+            return audio.to_soundarray(), audio.fps
+    return ASSET_CACHE.get(path, ('sound', fps), decode)
+
+def sound_clip(path, duration):
+    """Audio clip of the start of a sound file, decoded once per run."""
+    samples, fps = load_sound(path)
+    return AudioArrayClip(samples, fps=fps).with_duration(duration)
+
+def text_clip(text, asset_path, scale=1.0):
+    """Closing text of the last page."""
+    return TextClip(
+        text=text,
+        font=str(get_asset_path(asset_path, "Super_Adorable.ttf")),
+        font_size=scaled(150, scale),
+        color="black",
+        stroke_color='#ffffff',
+        stroke_width=max(1, scaled(5, scale)),
+        margin=scaled((50, 50), scale),
+    ).with_position(scaled(TEXT_POSITION, scale))
+
+class RevealAccumulator:
+    """Pre-flattened bitmap of the pieces already placed on the puzzle.
+
+    Pages are rendered in reveal order, so the bitmap for page k is built
+    from the one of page k - 1 by blending in a single piece, and only the
+    latest bitmap is kept in memory.
+    """
+
+    def __init__(self, size, pieces):
+        # pieces are (RGBA array, (x, y)) pairs in reveal order
+        self.size = size
+        self.pieces = pieces
+        self.count = None
+        self.rgba = None
+        self.mask = None
+
+    def flatten(self, count):
+        """Return the RGBA bitmap and float mask of the first count pieces."""
+        if self.count is None or count < self.count:
+            self.rgba = np.zeros((self.size[1], self.size[0], 4), dtype=np.uint8)
+            self.count = 0
+            self.mask = None
+        while self.count < count:
+            piece, (x, y) = self.pieces[self.count]
+            h, w = piece.shape[:2]
+            region = self.rgba[y:y + h, x:x + w]
+            alpha = piece[:, :, 3:] / 255.0
+            region[:, :, :3] = piece[:, :, :3] * alpha + region[:, :, :3] * (1 - alpha)
+            region[:, :, 3:] = 255 * alpha + region[:, :, 3:] * (1 - alpha)
+            self.count += 1
+            self.mask = None
+        if self.mask is None:
+            self.mask = self.rgba[:, :, 3] / 255.0
+        return self.rgba, self.mask
+
+class PagePlates:
+    """Time-invariant layers of a clip's pages, pre-flattened per page.
+
+    Within a page only the new pieces, the overlay GIFs and the text move,
+    so the background, the placed pieces, the outline and the frame are
+    flattened into canvas sized RGB plates: 'before' the page's batch of
+    pieces, 'after' it and, for the last page, 'final' without the outline.
+    Plates are built the first time a page is drawn and only the current
+    page's are kept. A batch is the range of the indices of the pieces a
+    page reveals.
+    """
+
+    def __init__(self, background_path, frame_path, outline_path, pieces,
+                 position=PUZZLE_POSITION, canvas=(CANVA_WIDTH, CANVA_HEIGHT)):
+        # pieces are (RGBA array, (x, y)) pairs in reveal order
+        self.position = position
+        self.canvas = canvas
+        self.pieces = pieces
+        self.outline = Image.open(outline_path).convert('RGBA')
+        self.background = Image.fromarray(load_image(background_path, canvas))
+        self.frame = Image.fromarray(load_image(frame_path, self.outline.size))
+        self.revealed = RevealAccumulator(self.outline.size, pieces)
+        self.batch = None
+        self.plates = None
+
+    def piece_origin(self, index):
+        """Canvas position of the top left corner of piece index."""
+        _, (x, y) = self.pieces[index]
+        return self.position[0] + x, self.position[1] + y
+
+    def batch_box(self, batch):
+        """Canvas box (left, top, right, bottom) around the pieces of batch, clipped to the canvas."""
+        boxes = []
+        for index in batch:
+            left, top = self.piece_origin(index)
+            piece = self.pieces[index][0]
+            boxes.append((left, top, left + piece.shape[1], top + piece.shape[0]))
+        return (max(min(box[0] for box in boxes), 0), max(min(box[1] for box in boxes), 0),
+                min(max(box[2] for box in boxes), self.canvas[0]),
+                min(max(box[3] for box in boxes), self.canvas[1]))
+
+    def flatten(self, batch):
+        """Return the plates of the page revealing batch."""
+        if batch == self.batch:
+            return self.plates
+        rgba, _ = self.revealed.flatten(batch.start)
+        before = self.background.copy()
+        before.alpha_composite(Image.fromarray(rgba), self.position)
+        after = before.copy()
+        for index in batch:
+            after.alpha_composite(Image.fromarray(self.pieces[index][0]), self.piece_origin(index))
+        final = after.copy()
+        final.alpha_composite(self.frame, self.position)
+        plates = {'final': final}
+        for name, plate in (('before', before), ('after', after)):
+            plate.alpha_composite(self.outline, self.position)
+            plate.alpha_composite(self.frame, self.position)
+            plates[name] = plate
+        self.batch = batch
+        self.plates = {name: np.asarray(plate.convert('RGB')) for name, plate in plates.items()}
+        return self.plates
+
+    def clip(self, batch, name, duration, box=None):
+        """Clip of a plate (or the box of it), flattened when first drawn."""
+        box = box or (0, 0, *self.canvas)
+        clip = VideoClip(duration=duration)
+        clip.frame_function = lambda t: self.flatten(batch)[name][box[1]:box[3], box[0]:box[2]]
+        clip.size = (box[2] - box[0], box[3] - box[1])
+        return clip.with_position(box[:2])
+
+    def batch_mask(self, batch):
+        """Float mask of the pieces of batch within their canvas box, None when off canvas."""
+        left, top, right, bottom = self.batch_box(batch)
+        if right <= left or bottom <= top:
+            return None
+        mask = np.zeros((bottom - top, right - left))
+        for index in batch:
+            piece = self.pieces[index][0]
+            x, y = self.piece_origin(index)
+            x0, y0 = max(x, left), max(y, top)
+            x1, y1 = min(x + piece.shape[1], right), min(y + piece.shape[0], bottom)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            region = mask[y0 - top:y1 - top, x0 - left:x1 - left]
+            np.maximum(region, piece[y0 - y:y1 - y, x0 - x:x1 - x, 3] / 255.0, out=region)
+        return mask
+
+    def page_clips(self, batch, page_duration, total_duration, fade_duration, is_last_piece):
+        """Layers of a page: the static plate and the new pieces fading in."""
+        clips = [self.clip(batch, 'before', total_duration)]
+        # The pieces fade in as the box of the 'after' plate, masked by the
+        # pieces, which already have the outline and frame over them
+        left, top, right, bottom = self.batch_box(batch)
+        mask = self.batch_mask(batch)
+        if mask is not None:
+            piece_clip = self.clip(batch, 'after', total_duration, (left, top, right, bottom))
+            piece_clip = piece_clip.with_mask(ImageClip(mask, is_mask=True).with_duration(total_duration))
+            clips.append(piece_clip.with_effects([vfx.CrossFadeIn(fade_duration)]))
+        if is_last_piece:
+            # the outline fades out at the end of the page
+            final_clip = self.clip(batch, 'final', total_duration - page_duration + fade_duration)
+            final_clip = final_clip.with_start(page_duration - fade_duration)
+            clips.append(final_clip.with_effects([vfx.CrossFadeIn(fade_duration)]))
+        return clips
+
+def close_page(page):
+    """Close the clips and audio readers of a page from create_puzzle_page."""
+    for clip in page.clips:
+        clip.close()
+        if clip.audio:
+            clip.audio.close()
+    page.close()
+
+class PageStream:
+    """The pages of a clip as one lazy clip, built one page at a time.
+
+    A page is created by build_page(batch, duration, is_last_piece) when its first
+    frame is drawn and closed as soon as the next page starts, so only one
+    page's readers and arrays are alive however many pages there are.
+    """
+
+    def __init__(self, timeline, build_page, size):
+        # timeline as from page_timeline
+        self.timeline = timeline
+        self.starts = [start for _, start, _, _ in timeline]
+        self.build_page = build_page
+        self.size = size
+        self.index = None
+        self.page = None
+
+    def frame(self, t):
+        index = page_at(self.starts, t)
+        batch, start, duration, is_last_piece = self.timeline[index]
+        if index != self.index:
+            self.close()
+            self.page = self.build_page(batch, duration, is_last_piece)
+            self.index = index
+        return self.page.get_frame(t - start)
+
+    def close(self):
+        if self.page is not None:
+            close_page(self.page)
+            self.page = None
+            self.index = None
+
+    def clip(self):
+        _, start, duration, _ = self.timeline[-1]
+        clip = VideoClip(duration=start + duration)
+        clip.frame_function = self.frame
+        clip.size = self.size
+        return clip
+
 def create_puzzle_page(background_path, piece_paths, outline_path, frame_size,
                        asset_path=None,  # Asset path for additional assets
                        is_last_piece=False, text=None, piece_data=None,
-                       is_first_piece=False):
-    """Create a video clip for a single puzzle piece reveal, stacking previous pieces."""
+                       is_first_piece=False, piece_images=None, plates=None, scale=1.0,
+                       page_duration=PAGE_DURATION, new_pieces=1, audio=True):
+    """Create a video clip for a puzzle piece reveal, stacking previous pieces.
+
+    The last new_pieces of piece_paths fade in together. The layout is
+    scaled by scale, the pieces and outline must be split at that scale
+    already. audio=False leaves out the sting, for pages played over a
+    premixed track.
+    """
+    canvas = scaled((CANVA_WIDTH, CANVA_HEIGHT), scale)
+    puzzle_position = scaled(PUZZLE_POSITION, scale)
     # Duration settings
-    page_duration = 3  # 5 seconds per page
-    fade_duration = 1  # 1 second fade in/out
-    extra_last_duration = 3 if is_last_piece else 0
+    fade_duration = FADE_DURATION  # 1 second fade in/out
+    extra_last_duration = LAST_PAGE_EXTRA if is_last_piece else 0
     total_duration = page_duration + extra_last_duration
 
-    # Load assets
-    bg_clip = ImageClip(background_path).resized((CANVA_WIDTH, CANVA_HEIGHT)).with_duration(total_duration)
+    if plates is not None:
+        # Static layers come pre-flattened, only the new piece is animated
+        batch = range(len(piece_paths) - new_pieces, len(piece_paths))
+        clips = plates.page_clips(batch, page_duration, total_duration, fade_duration, is_last_piece)
+    else:
+        # Load assets
+        bg_clip = ImageClip(background_path).resized(canvas).with_duration(total_duration)
 
-    # Stack all previous puzzle pieces (already revealed)
-    stacked_pieces = [
-        ImageClip(p).with_duration(total_duration).with_position(
-            piece_data[os.path.basename(p).replace('.png', '')]
-        )
-        for p in piece_paths
-    ]
+        # Stack all previous puzzle pieces (already revealed), taken from the
+        # decoded atlas when available
+        stacked_pieces = []
+        for p in piece_paths:
+            name = os.path.basename(p).replace('.png', '')
+            image = piece_images[name][0] if piece_images else p
+            stacked_pieces.append(
+                ImageClip(image).with_duration(total_duration).with_position(piece_data[name])
+            )
 
-    # Current puzzle piece (fade in)
-    current_piece_clip = stacked_pieces[-1]
-    current_piece_clip = current_piece_clip.with_effects([vfx.CrossFadeIn(fade_duration)])
-    stacked_pieces = stacked_pieces[:-1] + [current_piece_clip]
+        # Current puzzle pieces (fade in)
+        stacked_pieces = stacked_pieces[:-new_pieces] + [
+            clip.with_effects([vfx.CrossFadeIn(fade_duration)]) for clip in stacked_pieces[-new_pieces:]]
 
-    # Outline (composite with current piece, fade in, fade out if last)
-    outline_clip = ImageClip(outline_path).with_duration(page_duration).with_position((0, 0))
-    if is_last_piece:
-        outline_clip = outline_clip.with_effects([vfx.CrossFadeOut(fade_duration)])
+        # Outline (composite with current piece, fade in, fade out if last)
+        outline_clip = ImageClip(outline_path).with_duration(page_duration).with_position((0, 0))
+        if is_last_piece:
+            outline_clip = outline_clip.with_effects([vfx.CrossFadeOut(fade_duration)])
 
-    # Composite puzzle area (all pieces + outline)
-    puzzle_area = CompositeVideoClip(stacked_pieces + [outline_clip], size=(outline_clip.w, outline_clip.h)).with_position((231, 162)).with_duration(total_duration)
+        # Composite puzzle area (all pieces + outline)
+        puzzle_area = CompositeVideoClip(stacked_pieces + [outline_clip], size=(outline_clip.w, outline_clip.h)).with_position(puzzle_position).with_duration(total_duration)
 
-    # Frame, logo, subscribe
-    frame_path = str(get_asset_path(asset_path, "Frame.png"))
-    frame_clip = ImageClip(frame_path).resized((outline_clip.w, outline_clip.h)).with_position((231, 162)).with_duration(total_duration)
-    #logo_path = str(get_asset_path("Logo.png"))
-    #logo_clip = ImageClip(logo_path).resized((202, 202)).with_position((811, 843)).with_duration(total_duration)
-    subscribe_path = str(get_asset_path(asset_path, "Subscribe2.gif"))
-    subscribe_clip = VideoFileClip(subscribe_path, has_mask=True).resized((379, 147)).with_position((1498, 52)).with_duration(total_duration)
+        # Frame, logo
+        frame_path = str(get_asset_path(asset_path, "Frame.png"))
+        frame_clip = ImageClip(frame_path).resized((outline_clip.w, outline_clip.h)).with_position(puzzle_position).with_duration(total_duration)
+        #logo_path = str(get_asset_path("Logo.png"))
+        #logo_clip = ImageClip(logo_path).resized((202, 202)).with_position((811, 843)).with_duration(total_duration)
+        clips = [bg_clip, puzzle_area, frame_clip,
+                 #logo_clip,
+                 ]
 
-    # Compose all
-    clips = [bg_clip, puzzle_area, frame_clip,
-             #logo_clip,
-             subscribe_clip]
+    # Subscribe
+    subscribe_path = str(get_asset_path(asset_path, "Subscribe2.gif"))
+    subscribe_clip = overlay_clip(subscribe_path, total_duration, size=scaled(SUBSCRIBE_SIZE, scale))
+    subscribe_clip = subscribe_clip.with_position(scaled(SUBSCRIBE_POSITION, scale))
+    clips.append(subscribe_clip)
 
     # Add text if this is the last piece and text is provided
     if is_last_piece and text:
-        text_clip = TextClip(
-            text=text,
-            font=str(get_asset_path(asset_path, "Super_Adorable.ttf")),
-            font_size=150,
-            color="black",
-            stroke_color='#ffffff',
-            stroke_width=5,
-            margin=(50, 50),
-        ).with_position(("center", 714))
-        text_clip = text_clip.with_duration(extra_last_duration).with_start(page_duration).with_effects([
+        clips.append(text_clip(text, asset_path, scale).with_duration(extra_last_duration).with_start(page_duration).with_effects([
             vfx.CrossFadeIn(fade_duration)
-        ])
-        clips.append(text_clip)
+        ]))
 
         # Play Confetti.gif at center at the same time as text_clip
         confetti_path = str(get_asset_path(asset_path, "Confetti.gif"))
-        confetti_clip = VideoFileClip(confetti_path, has_mask=True)
+        confetti_clip = overlay_clip(confetti_path, CONFETTI_DURATION, size=None if scale == 1 else scale,
+                                     decode_duration=CONFETTI_DURATION)
         # Center confetti
-        confetti_clip = confetti_clip.with_start(page_duration).with_duration(2)
+        confetti_clip = confetti_clip.with_start(page_duration)
         confetti_clip = confetti_clip.with_position((
-            (CANVA_WIDTH - confetti_clip.w) // 2,
-            (CANVA_HEIGHT - confetti_clip.h) // 2
+            (canvas[0] - confetti_clip.w) // 2,
+            (canvas[1] - confetti_clip.h) // 2
         ))
         clips.append(confetti_clip)
 
-    # Add guitar string sound at the beginning
-    guitar_path = str(get_asset_path(asset_path, "guitar-string-fade-out-332451.mp3"))
-    guitar_audio = AudioFileClip(guitar_path)
-    guitar_audio = guitar_audio.with_duration(1.5)
-
     composite = CompositeVideoClip(clips).with_duration(total_duration)
-    # Add audio if not last page (or always, as intro sound)
-    composite = composite.with_audio(guitar_audio)
+    if audio:
+        # Add guitar string sound at the beginning
+        guitar_path = str(get_asset_path(asset_path, STING_ASSET))
+        guitar_audio = sound_clip(guitar_path, STING_DURATION)
+        # Add audio if not last page (or always, as intro sound)
+        composite = composite.with_audio(guitar_audio)
     return composite
 
-def make_jigsaw_clip(config, asset_path, output_path, fps=24):
-    """Create a complete jigsaw puzzle sequence for one image and write to mp4 file."""
+def blend_into(dst, src, alpha, scratch):
+    """Blend src over the uint8 view dst in place: dst = src * alpha + dst * (1 - alpha).
+
+    alpha is a float32 (h, w, 1) array or a scalar, scratch a float32 buffer
+    at least the size of dst.
+    """
+    work = scratch[:dst.shape[0], :dst.shape[1]]
+    np.subtract(src, dst, out=work, dtype=np.float32)
+    work *= alpha
+    work += dst
+    work += 0.5
+    np.copyto(dst, work, casting='unsafe')
+
+class NumpyPageRenderer:
+    """Frames of a clip blended with NumPy on preallocated buffers.
+
+    Draws the same layers create_puzzle_page composites with MoviePy: the
+    plates of PagePlates with the page's pieces fading in, the subscribe
+    overlay and, on the last page, the closing text and confetti. Every
+    frame is written into the same canvas buffer.
+    """
+
+    def __init__(self, plates, subscribe, text=None, confetti=None, scale=1.0):
+        # subscribe and confetti are (RGBA frames, fps) pairs as returned by
+        # load_overlay, text an RGBA array, all at the scale of the plates
+        self.plates = plates
+        self.canvas = width, height = plates.canvas
+        self.subscribe_position = scaled(SUBSCRIBE_POSITION, scale)
+        self.text_position = scaled(TEXT_POSITION, scale)
+        self.subscribe = subscribe
+        self.text = text
+        self.confetti = confetti
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.scratch = np.empty((height, width, 3), dtype=np.float32)
+        self.alpha = np.empty((height, width, 1), dtype=np.float32)
+        self.batch = None
+        self.mask = None
+        self.settled = None
+
+    def settle(self, batch):
+        """Mask of the pieces of batch and the page with them fully faded in."""
+        if batch != self.batch:
+            plates = self.plates.flatten(batch)
+            self.settled = plates['before'].copy()
+            self.mask = self.plates.batch_mask(batch)
+            if self.mask is not None:
+                self.mask = self.mask[:, :, None].astype(np.float32)
+                left, top, right, bottom = self.plates.batch_box(batch)
+                blend_into(self.settled[top:bottom, left:right],
+                           plates['after'][top:bottom, left:right], self.mask, self.scratch)
+            self.batch = batch
+        return self.mask, self.settled
+
+    def overlay(self, rgba, position, opacity=1.0):
+        """Blend an RGBA image at position, clipped to the canvas."""
+        x, y = position
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + rgba.shape[1], self.canvas[0]), min(y + rgba.shape[0], self.canvas[1])
+        if right <= left or bottom <= top:
+            return
+        rgba = rgba[top - y:bottom - y, left - x:right - x]
+        alpha = self.alpha[:bottom - top, :right - left]
+        np.multiply(rgba[:, :, 3:], opacity / 255.0, out=alpha, casting='same_kind')
+        blend_into(self.frame[top:bottom, left:right], rgba[:, :, :3], alpha, self.scratch)
+
+    def render(self, batch, t, is_last_piece):
+        """Frame at time t of the page revealing batch."""
+        plates = self.plates.flatten(batch)
+        mask, settled = self.settle(batch)
+        if mask is not None and t < FADE_DURATION:
+            np.copyto(self.frame, plates['before'])
+            left, top, right, bottom = self.plates.batch_box(batch)
+            blend_into(self.frame[top:bottom, left:right], plates['after'][top:bottom, left:right],
+                       mask * (t / FADE_DURATION), self.scratch)
+        elif is_last_piece and t >= PAGE_DURATION:
+            np.copyto(self.frame, plates['final'])
+        elif is_last_piece and t >= PAGE_DURATION - FADE_DURATION:
+            # the outline fades out at the end of the page
+            np.copyto(self.frame, settled)
+            opacity = (t - PAGE_DURATION + FADE_DURATION) / FADE_DURATION
+            blend_into(self.frame, plates['final'], opacity, self.scratch)
+        else:
+            np.copyto(self.frame, settled)
+        frames, fps = self.subscribe
+        self.overlay(frames[overlay_index(frames, fps, t)], self.subscribe_position)
+        if is_last_piece and t >= PAGE_DURATION:
+            if self.text is not None:
+                position = compute_position(self.text.shape[1::-1], self.canvas, self.text_position)
+                opacity = min((t - PAGE_DURATION) / FADE_DURATION, 1.0)
+                self.overlay(self.text, tuple(int(v) for v in position), opacity)
+            if self.confetti is not None and t < PAGE_DURATION + CONFETTI_DURATION:
+                frames, fps = self.confetti
+                rgba = frames[overlay_index(frames, fps, t - PAGE_DURATION)]
+                self.overlay(rgba, ((self.canvas[0] - rgba.shape[1]) // 2, (self.canvas[1] - rgba.shape[0]) // 2))
+        return self.frame
+
+def clip_timeline(config):
+    """Page timeline of the clip of a config entry.
+
+    With a target duration the pieces per page are the fewest that fit the
+    pages in it, and the pages but the last are stretched to fill it.
+    """
+    total_pieces = config.get('rows', 2) * config.get('columns', 2)
+    pieces_per_page = max(1, int(config.get('pieces_per_page', PIECES_PER_PAGE)))
+    page_duration = PAGE_DURATION
+    if config.get('duration'):
+        duration = float(config['duration'])
+        n_pages = max(1, int((duration - LAST_PAGE_EXTRA) // PAGE_DURATION))
+        pieces_per_page = -(-total_pieces // min(n_pages, total_pieces))
+        n_pages = -(-total_pieces // pieces_per_page)
+        if n_pages > 1:
+            page_duration = max(PAGE_DURATION, (duration - PAGE_DURATION - LAST_PAGE_EXTRA) / (n_pages - 1))
+    return page_timeline(total_pieces, pieces_per_page, page_duration)
+
+def page_timeline(total_pieces, pieces_per_page=PIECES_PER_PAGE, page_duration=PAGE_DURATION):
+    """(batch, start, duration, is_last_piece) of each page of a clip.
+
+    batch is the range of the indices of the pieces revealed by the page.
+    The last page lasts PAGE_DURATION + LAST_PAGE_EXTRA whatever page_duration.
+    """
+    pages = []
+    start = 0
+    for first in range(0, total_pieces, pieces_per_page):
+        batch = range(first, min(first + pieces_per_page, total_pieces))
+        is_last_piece = batch.stop == total_pieces
+        duration = PAGE_DURATION + LAST_PAGE_EXTRA if is_last_piece else page_duration
+        pages.append((batch, start, duration, is_last_piece))
+        start += duration
+    return pages
+
+def page_at(starts, t):
+    """Index of the page playing at time t, from the start times of contiguous pages."""
+    return max(bisect.bisect_right(starts, t) - 1, 0)
+
+def segment_pages(pages, segments):
+    """Split pages into at most segments contiguous (start, stop) runs of
+    about the same duration."""
+    total = sum(duration for _, _, duration, _ in pages)
+    runs = []
+    first = 0
+    for idx, (_, start, duration, _) in enumerate(pages):
+        if len(runs) < segments - 1 and start + duration >= total * (len(runs) + 1) / segments:
+            runs.append((first, idx + 1))
+            first = idx + 1
+    if first < len(pages):
+        runs.append((first, len(pages)))
+    return runs
+
+def place_sound(track, samples, start, sample_fps):
+    """Add samples onto track from start seconds, cut at the end of the track."""
+    samples = samples.reshape(len(samples), -1)
+    offset = int(start * sample_fps)
+    count = max(0, min(len(samples), len(track) - offset))
+    track[offset:offset + count] += samples[:count]
+
+def write_wav(path, track, sample_fps):
+    """Write float samples in [-1, 1] as a 16 bit WAV."""
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(track.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_fps)
+        f.writeframes((np.clip(track, -1, 1) * 32767).astype('<i2').tobytes())
+    return path
+
+def write_page_audio(path, pages, sting, sample_fps):
+    """Write a WAV with the sting at the start of every page."""
+    duration = pages[-1][1] + pages[-1][2]
+    sting = sting.reshape(len(sting), -1)[:int(STING_DURATION * sample_fps)]
+    track = np.zeros((int(duration * sample_fps), sting.shape[1]), dtype=np.float32)
+    for _, start, _, _ in pages:
+        place_sound(track, sting, start, sample_fps)
+    return write_wav(path, track, sample_fps)
+
+def write_soundtrack(path, duration, sounds, bgm=None, sample_fps=SAMPLE_FPS):
+    """Mix the soundtrack of a whole video once and write it as a stereo WAV.
+
+    sounds are (start, samples) pairs of PCM at sample_fps. bgm samples are
+    looped under everything, faded out at the end and turned down to
+    BGM_VOLUME.
+    """
+    track = np.zeros((int(round(duration * sample_fps)), 2), dtype=np.float32)
+    for start, samples in sounds:
+        place_sound(track, samples, start, sample_fps)
+    if bgm is not None and len(bgm):
+        bgm = bgm.reshape(len(bgm), -1)
+        looped = bgm[np.arange(len(track)) % len(bgm)]
+        fade = np.minimum((len(track) - np.arange(len(track))) / (BGM_FADE_DURATION * sample_fps), 1)
+        track += looped * (fade * BGM_VOLUME)[:, None]
+    return write_wav(path, track, sample_fps)
+
+def write_raw_video(render, n_frames, output_path, fps, audio_path=None, logger="bar",
+                    size=(CANVA_WIDTH, CANVA_HEIGHT), profile=DEFAULT_PROFILE):
+    """Encode n_frames frames of render(index) piped as raw RGB to ffmpeg."""
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}",
+           "-r", str(fps), "-i", "-"]
+    if audio_path is not None:
+        cmd += ["-i", audio_path, "-c:a", "aac", "-ar", "44100", "-ac", "2"]
+    cmd += [*encoder_args(profile, fps), output_path]
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    # a broken pipe means ffmpeg exited early, its exit status tells why
+    broken = False
+    try:
+        for index in default_bar_logger(logger).iter_bar(frame_index=range(n_frames)):
+            try:
+                proc.stdin.write(render(index).data)
+            except BrokenPipeError:
+                broken = True
+                break
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            broken = True
+        proc.wait()
+    if proc.returncode or broken:
+        raise IOError(f"ffmpeg failed to encode {output_path} (exit status {proc.returncode})")
+    report_encode(output_path, n_frames, time.perf_counter() - started, profile)
+    return output_path
+
+def render_numpy_clip(plates, pages, text, asset_path, output_path, fps, work_dir, logger="bar",
+                      scale=1.0, profile=DEFAULT_PROFILE):
+    """Render pages (as from page_timeline) with NumpyPageRenderer, piped to ffmpeg."""
+    text_image = None
+    if text:
+        clip = text_clip(text, asset_path, scale)
+        text_image = np.dstack([clip.get_frame(0), np.round(clip.mask.get_frame(0) * 255)]).astype(np.uint8)
+    renderer = NumpyPageRenderer(
+        plates,
+        load_overlay(str(get_asset_path(asset_path, "Subscribe2.gif")), scaled(SUBSCRIBE_SIZE, scale)),
+        text=text_image,
+        confetti=load_overlay(str(get_asset_path(asset_path, "Confetti.gif")),
+                              None if scale == 1 else scale, decode_duration=CONFETTI_DURATION),
+        scale=scale,
+    )
+    sting, sample_fps = load_sound(str(get_asset_path(asset_path, STING_ASSET)))
+    audio_path = write_page_audio(os.path.join(work_dir, "audio.wav"), pages, sting, sample_fps)
+    duration = pages[-1][1] + pages[-1][2]
+    starts = [start for _, start, _, _ in pages]
+
+    def render(index):
+        t = index / fps
+        batch, start, _, is_last_piece = pages[page_at(starts, t)]
+        return renderer.render(batch, t - start, is_last_piece)
+
+    return write_raw_video(render, int(duration * fps), output_path, fps, audio_path, logger,
+                           size=plates.canvas, profile=profile)
+
+def make_jigsaw_clip(config, asset_path, output_path, fps=24, split_cache=None, logger="bar",
+                     engine=ENGINE_MOVIEPY, scale=1.0, profile=DEFAULT_PROFILE, segments=1,
+                     split_dir=None, page_range=None, streaming=False):
+    """Create a complete jigsaw puzzle sequence for one image and write to mp4 file.
+
+    The whole clip is rendered at scale times the canvas size, the image is
+    fitted inside PUZZLE_SIZE at that scale before it is split, the puzzle
+    area and frame take the size of its outline however large the source,
+    and the clip is encoded with the given encoding profile. With segments > 1 the
+    pages are rendered as that many time segments in parallel processes,
+    joined without re-encoding. split_dir and page_range are how a segment reuses the
+    split pieces and renders only its (start, stop) pages. streaming builds
+    each MoviePy page just before it is rendered and closes it right after,
+    keeping memory and open files flat however large the grid.
+    """
     background_path = str(get_asset_path(asset_path, config['background']))
     image_path = str(get_asset_path(asset_path, config['image']))
     rows = config.get('rows', 2)
@@ -145,16 +816,26 @@ def make_jigsaw_clip(config, asset_path, output_path, fps=24):
     order = config.get('order', None)
 
     tmp_dir = tempfile.mkdtemp()
+    piece_dir = split_dir or tmp_dir
     try:
-        # Generate jigsaw pieces (files will be created in tmp_dir)
-        split_image(image_path, rows, columns, tmp_dir)
+        # Generate jigsaw pieces (files will be created in piece_dir), packed
+        # into an atlas with fast compression as they are only intermediate
+        if split_dir is None:
+            split_path = fit_image(image_path, scaled(PUZZLE_SIZE, scale), tmp_dir)
+            if split_cache is not None:
+                piece_dir = split_cache.split(split_path, rows, columns, atlas=True, compress_level=1)
+            else:
+                split_image(split_path, rows, columns, piece_dir, atlas=True, compress_level=1)
+        # piece_dir is new (or a reused cache entry), so forget any stale
+        # index of a directory that had the same name before
+        invalidate_asset_index(piece_dir)
+        piece_images = load_atlas(piece_dir)
         # Load piece data
         import json
-        piece_data_path = os.path.join(tmp_dir, 'piece_data.json')
+        piece_data_path = os.path.join(piece_dir, 'piece_data.json')
         with open(piece_data_path) as f:
             piece_data = json.load(f)
-        total_pieces = rows * columns
-        frame_size = (1550, 880)
+        frame_size = scaled(PUZZLE_SIZE, scale)
         # Generate all (row, col) pairs
         all_indices = [(r, c) for r in range(rows) for c in range(columns)]
         # Determine reveal order
@@ -168,86 +849,510 @@ def make_jigsaw_clip(config, asset_path, output_path, fps=24):
             rng = random.Random(seed)
             reveal_order = all_indices.copy()
             rng.shuffle(reveal_order)
-        pages = []
-        revealed_pieces = []
-        for piece_idx, (row, col) in enumerate(reveal_order):
-            piece_name = f'piece_{row}_{col}.png'
-            piece_path = os.path.join(tmp_dir, piece_name)
-            revealed_pieces.append(piece_path)
-            outline_path = os.path.join(tmp_dir, 'piece_outline.png')
-            is_last_piece = (piece_idx == total_pieces - 1)
-            is_first_piece = (piece_idx == 0)
-            page = create_puzzle_page(
+        outline_path = os.path.join(piece_dir, 'piece_outline.png')
+        plates = PagePlates(
+            background_path,
+            str(get_asset_path(asset_path, "Frame.png")),
+            outline_path,
+            [piece_images[f'piece_{row}_{col}'] for row, col in reveal_order],
+            position=scaled(PUZZLE_POSITION, scale),
+            canvas=scaled((CANVA_WIDTH, CANVA_HEIGHT), scale),
+        )
+        timeline = clip_timeline(config)
+        if segments > 1 and page_range is None and len(timeline) > 1:
+            # Render contiguous runs of pages in parallel and join them as
+            # they are, every page starts its own fades and sound
+            runs = segment_pages(timeline, segments)
+            jobs = [(config, asset_path, os.path.join(tmp_dir, f"segment_{idx}.mp4"),
+                     dict(split_dir=piece_dir, page_range=run))
+                    for idx, run in enumerate(runs)]
+            segment_paths = render_clips_parallel(
+                jobs, len(jobs), tmp_dir, logger=logger,
+                fps=fps, engine=engine, scale=scale, profile=profile, streaming=streaming)
+            video_path = join_clips(segment_paths, os.path.join(tmp_dir, "video.mp4"), tmp_dir)
+            # AAC priming would delay each segment's audio at the joins, so
+            # the stings are laid out once on the whole timeline instead
+            sting, sample_fps = load_sound(str(get_asset_path(asset_path, STING_ASSET)))
+            audio_path = write_page_audio(os.path.join(tmp_dir, "audio.wav"), timeline, sting, sample_fps)
+            return mux_audio(video_path, audio_path, output_path, audio_codec="aac")
+        if page_range is not None:
+            # a segment starts at its first page
+            timeline = timeline[page_range[0]:page_range[1]]
+            offset = timeline[0][1]
+            timeline = [(batch, start - offset, duration, is_last_piece)
+                        for batch, start, duration, is_last_piece in timeline]
+        if engine == ENGINE_NUMPY:
+            return render_numpy_clip(plates, timeline, text, asset_path, output_path, fps,
+                                     tmp_dir, logger=logger, scale=scale, profile=profile)
+
+        def build_page(batch, duration, is_last_piece):
+            revealed_pieces = [os.path.join(piece_dir, f'piece_{row}_{col}.png')
+                               for row, col in reveal_order[:batch.stop]]
+            is_first_piece = (batch.start == 0)
+            return create_puzzle_page(
                 background_path,
-                revealed_pieces.copy(),
+                revealed_pieces,
                 outline_path,
                 frame_size,
-                asset_path=str(tmp_dir) + ',' + asset_path,
+                asset_path=str(piece_dir) + ',' + asset_path,
                 is_last_piece=is_last_piece,
                 text=text if is_last_piece else None,
                 piece_data=piece_data,
                 is_first_piece=is_first_piece,
+                piece_images=piece_images,
+                plates=plates,
+                scale=scale,
+                page_duration=duration - (LAST_PAGE_EXTRA if is_last_piece else 0),
+                new_pieces=len(batch),
+                # streamed pages play over the page WAV
+                audio=not streaming,
             )
-            pages.append(page)
-        with concatenate_videoclips(pages, method="compose") as final_clip:
-            final_clip.write_videofile(output_path, fps=fps, codec="libx264", audio_codec="aac")
 
+        if streaming:
+            # the stings are laid out as one track, the pages' own audio is
+            # never built
+            stream = PageStream(timeline, build_page, plates.canvas)
+            sting, sample_fps = load_sound(str(get_asset_path(asset_path, STING_ASSET)))
+            audio = write_page_audio(os.path.join(tmp_dir, "audio.wav"), timeline, sting, sample_fps)
+            final_clip = stream.clip()
+        else:
+            pages = [build_page(batch, duration, is_last_piece) for batch, _, duration, is_last_piece in timeline]
+            audio = True
+            final_clip = concatenate_videoclips(pages, method="compose")
+        try:
+            started = time.perf_counter()
+            final_clip.write_videofile(output_path, fps=fps, audio=audio, audio_codec="aac", temp_audiofile_path=tmp_dir,
+                                       logger=logger, **encoder_options(profile, fps))
+            report_encode(output_path, int(final_clip.duration * fps), time.perf_counter() - started, profile)
+        finally:
             # Cleanup clips
-            for page in pages:
-                for clip in page.clips:
-                    clip.close()
-                    if clip.audio:
-                        clip.audio.close()
-                page.close()
+            if streaming:
+                stream.close()
+            else:
+                for page in pages:
+                    close_page(page)
+            final_clip.close()
         return output_path
     finally:
         shutil.rmtree(tmp_dir)
+        invalidate_asset_index(piece_dir)
+
+# sha256 of asset files, keyed on (path, mtime, size)
+_file_digests = {}
+
+def file_digest(path):
+    """sha256 of a file's content, computed once per version of the file."""
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+class ClipCache():
+    """On-disk cache of clips rendered by make_jigsaw_clip.
+
+    Entries are keyed on the clip's config entry, the content of every asset
+    it renders, the fps, the canvas size, the render engine and
+    RENDERER_VERSION. The least recently used entries are evicted once the
+    cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, config, asset_path, **options):
+        names = [config['background'], config['image'], *CLIP_ASSETS]
+        assets = {name: file_digest(get_asset_path(asset_path, name)) for name in names}
+        params = dict(options, config=config, assets=assets, canvas=[CANVA_WIDTH, CANVA_HEIGHT],
+                      version=RENDERER_VERSION, generator_version=GENERATOR_VERSION)
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def entry(self, config, asset_path, **options):
+        """Path the clip of config is cached at."""
+        return os.path.join(self.cache_dir, self.key(config, asset_path, **options) + ".mp4")
+
+    def get(self, entry):
+        """Return whether entry is cached, marking it as recently used."""
+        if os.path.isfile(entry):
+            self.hits += 1
+            os.utime(entry)
+            return True
+        self.misses += 1
+        return False
+
+    def store(self, clip_path, entry):
+        """Move a rendered clip into the cache as entry."""
+        # move next to the entry and rename, readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(prefix=".clip-", suffix=".mp4", dir=self.cache_dir)
+        os.close(fd)
+        shutil.move(clip_path, tmp_path)
+        os.replace(tmp_path, entry)
+        return entry
+
+    def entries(self):
+        """Return (mtime, size, path) for every entry, oldest first."""
+        entries = []
+        for f in os.scandir(self.cache_dir):
+            if f.name.startswith(".") or not f.is_file():
+                continue
+            stat = f.stat()
+            entries.append((stat.st_mtime, stat.st_size, f.path))
+        return sorted(entries)
 
-def generate_jigsaw_video(input_dir, output, asset_path=None, fps=24, compile=False, logger=None, intro=None, outtro=None, bgm=None):
+    def evict(self, keep=()):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            os.remove(path)
+            total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+# Progress queue of the pool's worker processes, set by init_render_worker
+_progress_queue = None
+
+def init_render_worker(progress_queue, work_dir):
+    """Give each worker process its own temp dir under work_dir."""
+    global _progress_queue
+    _progress_queue = progress_queue
+    tempfile.tempdir = tempfile.mkdtemp(prefix=f"worker_{os.getpid()}_", dir=work_dir)
+
+def render_clip_job(idx, page, asset_path, clip_path, split_cache_dir, options):
+    """Render one config clip in a worker process, reporting progress as idx.
+
+    Returns the clip path and the asset and split cache lookups the job made.
+    """
+    # the parent evicts once the pool is done, an entry another worker is
+    # still reading is never removed
+    split_cache = SplitCache(split_cache_dir, max_bytes=None) if split_cache_dir else None
+    logger = QueueProgressLogger(_progress_queue, idx)
+    # the worker's asset cache outlives the job, count only its lookups
+    before = ASSET_CACHE.stats()
+    make_jigsaw_clip(page, asset_path, clip_path, split_cache=split_cache, logger=logger, **options)
+    after = ASSET_CACHE.stats()
+    lookups = {
+        "asset_hits": after["hits"] - before["hits"],
+        "asset_misses": after["misses"] - before["misses"],
+        "split_hits": split_cache.hits if split_cache is not None else 0,
+        "split_misses": split_cache.misses if split_cache is not None else 0,
+    }
+    return clip_path, lookups
+
+def render_clips_parallel(jobs, workers, work_dir, split_cache=None, logger="bar", **options):
+    """Render (page, asset_path, clip_path, job_options) jobs in a process
+    pool, returning paths in job order.
+
+    The asset and split cache lookups of the workers are added to
+    ASSET_CACHE and split_cache, which is evicted once the pool is done.
+
+    options, updated by the job_options of each job, are passed on to
+    make_jigsaw_clip.
+
+    Frame progress of all workers is summed into one frame_index bar of
+    logger. Clips that have not started yet count with the average frame
+    total of the clips that have.
+    """
+    logger = default_bar_logger(logger)
+    progress_queue = multiprocessing.Queue()
+    split_cache_dir = split_cache.cache_dir if split_cache is not None else None
+    # Resolve the job through the import system so it pickles even when this
+    # module was loaded from a file spec (as streamlit_app.py does)
+    job = getattr(importlib.import_module(__name__), 'render_clip_job')
+    progress = {idx: {'index': 0, 'total': None} for idx in range(len(jobs))}
+    reported_total = None
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                             initargs=(progress_queue, work_dir)) as executor:
+        futures = [
+            executor.submit(job, idx, page, asset_path, clip_path, split_cache_dir, dict(options, **job_options))
+            for idx, (page, asset_path, clip_path, job_options) in enumerate(jobs)
+        ]
+        while True:
+            try:
+                idx, attr, value = progress_queue.get(timeout=0.2)
+            except queue.Empty:
+                if all(future.done() for future in futures):
+                    break
+                continue
+            progress[idx][attr] = value
+            totals = [p['total'] for p in progress.values() if p['total']]
+            # no total is known until a worker has reported one
+            total = None
+            if totals:
+                total = sum(totals) + (len(progress) - len(totals)) * sum(totals) // len(totals)
+            if total is not None and total != reported_total:
+                logger(frame_index__total=total)
+                reported_total = total
+            logger(frame_index__index=sum(p['index'] for p in progress.values()))
+        results = [future.result() for future in futures]
+    for _, lookups in results:
+        ASSET_CACHE.count(lookups["asset_hits"], lookups["asset_misses"])
+        if split_cache is not None:
+            split_cache.hits += lookups["split_hits"]
+            split_cache.misses += lookups["split_misses"]
+    if split_cache is not None:
+        split_cache.evict()
+    return [path for path, _ in results]
+
+def run_ffmpeg(*args):
+    """Run the ffmpeg binary MoviePy uses, raising on failure."""
+    subprocess.run([FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *args], check=True)
+
+def pixel_format(path):
+    """Pixel format of the first video stream of path, None when unknown.
+
+    Read with ffprobe when it is installed, otherwise from the stream info
+    ffmpeg prints, as ffmpeg_parse_infos does not report it.
+    """
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        result = subprocess.run([ffprobe, "-v", "error", "-select_streams", "v:0",
+                                 "-show_entries", "stream=pix_fmt", "-of", "csv=p=0", path],
+                                capture_output=True, text=True)
+        return result.stdout.strip() or None
+    result = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Stream #\S+.*?: Video: [^,]+, (\w+)", result.stderr)
+    return match.group(1) if match else None
+
+def stream_params(path):
+    """Parameters that must match for clips to be joined by stream copy."""
+    infos = ffmpeg_parse_infos(path)
+    return (
+        infos.get('video_codec_name'),
+        infos.get('video_profile'),
+        pixel_format(path),
+        tuple(infos.get('video_size') or ()),
+        infos.get('video_fps'),
+        infos.get('audio_found'),
+        infos.get('audio_fps') if infos.get('audio_found') else None,
+    )
+
+def conform_clip(path, params, output, profile=DEFAULT_PROFILE):
+    """Encode path once to match the stream params of the rendered clips.
+
+    Smaller or larger videos are scaled to fit and centered, a missing
+    audio track is replaced by silence.
+    """
+    _, _, _, (width, height), fps, _, audio_fps = params
+    audio_fps = audio_fps or 44100
+    args = ["-i", path]
+    if ffmpeg_parse_infos(path).get('audio_found'):
+        args += ["-map", "0:v:0", "-map", "0:a:0"]
+    else:
+        args += ["-f", "lavfi", "-i", f"anullsrc=channel_layout=stereo:sample_rate={audio_fps}",
+                 "-map", "0:v:0", "-map", "1:a:0", "-shortest"]
+    args += [
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+               f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={fps}",
+        *encoder_args(profile, fps),
+        "-c:a", "aac", "-ar", str(audio_fps), "-ac", "2",
+        output,
+    ]
+    run_ffmpeg(*args)
+    return output
+
+def join_clips(paths, output, work_dir):
+    """Concatenate mp4 files with the concat demuxer, without re-encoding."""
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    run_ffmpeg("-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy",
+               "-movflags", "+faststart", output)
+    return output
+
+def mux_audio(video_path, audio_path, output, audio_codec="copy"):
+    """Replace the audio of video_path with audio_path, copying the video stream."""
+    args = ["-i", video_path, "-i", audio_path, "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "copy", "-c:a", audio_codec]
+    if audio_codec != "copy":
+        args += ["-ar", "44100", "-ac", "2"]
+    run_ffmpeg(*args, "-movflags", "+faststart", output)
+    return output
+
+def conform_videos(clip_paths, intro=None, outtro=None, work_dir=None, profile=DEFAULT_PROFILE):
+    """Paths of the intro, the rendered clips and the outtro, ready to be joined by stream copy.
+
+    Only intro/outtro videos whose codec parameters differ from the rendered
+    clips are encoded, once each, everything else is used as is.
+    """
+    params = stream_params(clip_paths[0])
+    paths = []
+    for name, path in (("intro", intro), *((None, p) for p in clip_paths), ("outtro", outtro)):
+        if path is None:
+            continue
+        if name is not None and stream_params(path) != params:
+            path = conform_clip(path, params, os.path.join(work_dir, f"{name}.mp4"), profile)
+        paths.append(path)
+    return paths
+
+def video_duration(path):
+    """Duration of the video stream of path, as probed."""
+    infos = ffmpeg_parse_infos(path)
+    return infos.get('video_duration') or infos['duration']
+
+def join_video(paths, output, soundtrack=None, work_dir=None):
+    """Join videos from conform_videos by stream copy, then mux the soundtrack."""
+    if not soundtrack:
+        return join_clips(paths, output, work_dir)
+    joined = join_clips(paths, os.path.join(work_dir, "joined.mp4"), work_dir)
+    return mux_audio(joined, soundtrack, output, audio_codec="aac")
+
+def mix_soundtrack(path, parts, asset_path, bgm=None):
+    """Mix the soundtrack of the final video from its timeline.
+
+    parts are (config entry or intro/outtro video path, duration) pairs in
+    playing order, with the durations of the videos actually joined, so
+    frame rounding or conform padding cannot shift later sounds. The clips'
+    stings are laid out from their page timelines with one decoded copy of
+    the sting, the intro and outtro keep their own audio.
+    """
+    sting, _ = load_sound(str(get_asset_path(asset_path, STING_ASSET)), SAMPLE_FPS)
+    sting = sting[:int(STING_DURATION * SAMPLE_FPS)]
+    sounds = []
+    offset = 0
+    for part, duration in parts:
+        if isinstance(part, str):
+            # intro or outtro video
+            if ffmpeg_parse_infos(part).get('audio_found'):
+                sounds.append((offset, load_sound(part, SAMPLE_FPS)[0]))
+        else:
+            sounds.extend((offset + start, sting) for _, start, _, _ in clip_timeline(part))
+        offset += duration
+    bgm_samples = load_sound(bgm, SAMPLE_FPS)[0] if bgm else None
+    return write_soundtrack(path, offset, sounds, bgm_samples)
+
+def generate_jigsaw_video(input_dir, output, asset_path=None, fps=24, compile=False, logger=None, intro=None, outtro=None, bgm=None,
+                          split_cache=None, join=JOIN_REENCODE, workers=1, engine=ENGINE_MOVIEPY, clip_cache=None,
+                          draft=False, segments=1, profile=None, streaming=False):
     """Entry point for generating jigsaw video from arguments."""
     with open(f"{input_dir}/config.json") as f:
         config = json.load(f)
     # Set asset path from argument or input dir
     asset_path = asset_path if asset_path else input_dir
     asset_path = os.path.dirname(os.path.abspath(__file__)) + '/assets,' + asset_path
-    import tempfile
     temp_dir = tempfile.mkdtemp()
-    clip_paths = []
+    # Reuse split pieces across runs when a cache directory is given
+    if isinstance(split_cache, str):
+        split_cache = SplitCache(split_cache)
+    # Reuse clips whose inputs did not change since they were rendered
+    if isinstance(clip_cache, str):
+        clip_cache = ClipCache(clip_cache)
+    # Draft renders trade resolution, fps and encode quality for speed
+    options = dict(fps=fps, engine=engine, scale=1.0, profile=profile or DEFAULT_PROFILE)
+    if draft:
+        options.update(fps=min(fps, DRAFT_FPS), scale=DRAFT_SCALE, profile=profile or DRAFT_PROFILE)
+    fps = options['fps']
+    pages = config.get('clips', [])
+    clip_paths = [os.path.join(temp_dir, f"clip_{idx}.mp4") for idx in range(len(pages))]
+    entries = {}
+    if clip_cache is not None:
+        for idx, page in enumerate(pages):
+            entry = clip_cache.entry(page, asset_path, **options)
+            if clip_cache.get(entry):
+                clip_paths[idx] = entry
+            else:
+                entries[idx] = entry
+    else:
+        entries = dict.fromkeys(range(len(pages)))
+    parallel = workers > 1 and len(entries) > 1
+    if parallel:
+        # Render clips in parallel processes, assembled in config order
+        jobs = [(pages[idx], asset_path, clip_paths[idx], {}) for idx in entries]
+        render_clips_parallel(jobs, min(workers, len(jobs)), temp_dir,
+                              split_cache=split_cache, logger=logger or "bar", segments=segments,
+                              streaming=streaming, **options)
     # Generate each puzzle clip as a separate mp4
-    for idx, page in enumerate(config.get('clips', [])):
-        clip_path = os.path.join(temp_dir, f"clip_{idx}.mp4")
-        make_jigsaw_clip(page, asset_path, clip_path, fps=fps)
-        print(clip_path)
-        clip_paths.append(clip_path)
+    for idx in [] if parallel else entries:
+        make_jigsaw_clip(pages[idx], asset_path, clip_paths[idx], split_cache=split_cache,
+                         logger=logger or "bar", segments=segments, streaming=streaming, **options)
+        print(clip_paths[idx])
+    if clip_cache is not None:
+        for idx, entry in entries.items():
+            clip_paths[idx] = clip_cache.store(clip_paths[idx], entry)
+        clip_cache.evict(keep=set(clip_paths))
+        stats = clip_cache.stats()
+        print(f"Clip cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MB")
+    stats = ASSET_CACHE.stats()
+    if parallel:
+        # the decoded assets stay in the worker processes, only the lookups
+        # are counted here
+        print(f"Asset cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"across {min(workers, len(entries))} workers")
+    else:
+        print(f"Asset cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MB")
+    if split_cache is not None:
+        stats = split_cache.stats()
+        print(f"Split cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MB")
+    # The whole soundtrack is mixed once from the timeline and muxed in,
+    # the audio of the clips is not decoded again
+    parts = ([intro] if intro else []) + pages + ([outtro] if outtro else [])
+    soundtrack_path = os.path.join(temp_dir, "soundtrack.wav")
+    if join == JOIN_COPY and clip_paths:
+        videos = conform_videos(clip_paths, intro=intro, outtro=outtro, work_dir=temp_dir,
+                                profile=options['profile'])
+        soundtrack = mix_soundtrack(soundtrack_path, zip(parts, map(video_duration, videos)), asset_path, bgm=bgm)
+        join_video(videos, output, soundtrack=soundtrack, work_dir=temp_dir)
+        shutil.rmtree(temp_dir)
+        return
     # Build final video sequence
     final_clips = []
+    # intro and outtro are full size, scale them like the clips
     if intro:
-        final_clips.append(VideoFileClip(intro))
+        final_clips.append(VideoFileClip(intro).resized(options['scale']) if draft else VideoFileClip(intro))
     for path in clip_paths:
         final_clips.append(VideoFileClip(path))
     if outtro:
-        final_clips.append(VideoFileClip(outtro))
+        final_clips.append(VideoFileClip(outtro).resized(options['scale']) if draft else VideoFileClip(outtro))
     if not final_clips:
         print("No valid clips found.")
         return
+    soundtrack = None
+    if pages:
+        durations = [clip.duration for clip in final_clips]
+        soundtrack = mix_soundtrack(soundtrack_path, zip(parts, durations), asset_path, bgm=bgm)
     final = final_clips[0] if len(final_clips) == 1 else concatenate_videoclips(final_clips, method="compose")
-    if bgm:
+    if bgm and not soundtrack:
         audio_bgm = AudioFileClip(bgm)
         audio_bgm = (
             audio_bgm.with_effects([
                 afx.AudioLoop(duration=final.duration),
-                afx.AudioFadeOut(duration=2),
-                afx.MultiplyVolume(0.33)
+                afx.AudioFadeOut(duration=BGM_FADE_DURATION),
+                afx.MultiplyVolume(BGM_VOLUME)
             ])
         )
         if final.audio is not None:
             final = final.with_audio(CompositeAudioClip([final.audio, audio_bgm]))
         else:
             final = final.with_audio(audio_bgm)
-    final.write_videofile(output, fps=fps, codec="libx264", audio_codec="aac")
+    started = time.perf_counter()
+    final.write_videofile(output, fps=fps, audio=soundtrack or True, audio_codec="aac", temp_audiofile_path=temp_dir,
+                          logger=logger or "bar", **encoder_options(options['profile'], fps))
+    report_encode(output, int(final.duration * fps), time.perf_counter() - started, options['profile'])
     final.close()
     # Cleanup temp clips
-    import shutil
     shutil.rmtree(temp_dir)
 
 def main():
@@ -260,7 +1365,16 @@ def main():
         compile=args.compile,
         intro=args.intro,
         outtro=args.outtro,
-        bgm=args.bgm
+        bgm=args.bgm,
+        split_cache=args.split_cache,
+        join=args.join,
+        workers=args.workers,
+        engine=args.engine,
+        clip_cache=args.clip_cache,
+        draft=args.draft,
+        segments=args.segments,
+        profile=args.profile,
+        streaming=args.streaming,
     )
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ import json
 from pathlib import Path
 import shutil
 import importlib.util
-from utils import MoviePyProgressLogger
+from utils import MoviePyProgressLogger, invalidate_asset_index
 
 st.title("🎬 Jigsaw Puzzle Movie Generator")
 
@@ -44,6 +44,8 @@ config_text = st.text_area(
 )
 
 fps = st.number_input("Frames per second (FPS)", min_value=1, max_value=60, value=24)
+draft = st.checkbox("Draft preview", value=False,
+                    help="Render a fast low resolution, low fps preview to review the config")
 
 generate_btn = st.button("Generate Movie")
 
@@ -75,6 +77,9 @@ if generate_btn:
                 with open(config_path, "w") as f:
                     json.dump(config_json, f)
                 output_path = os.path.join(tmpdir, "output.mp4")
+                # the temp dir may reuse the name of an earlier run's, whose
+                # contents the asset index could still hold
+                invalidate_asset_index(tmpdir)
                 try:
                     spec = importlib.util.spec_from_file_location("jigsaw_puzzle_movie_generator", os.path.join(os.path.dirname(__file__), "jigsaw_puzzle_movie_generator.py"))
                     jigsaw_mod = importlib.util.module_from_spec(spec)
@@ -89,10 +94,13 @@ if generate_btn:
                         logger=logger,
                         intro=intro_path,
                         outtro=outtro_path,
-                        bgm=bgm_path
+                        bgm=bgm_path,
+                        draft=draft,
                     )
                 except Exception as e:
                     st.error(f"Movie generation failed:\n{e}")
+                finally:
+                    invalidate_asset_index(tmpdir)
                 if not os.path.exists(output_path):
                     st.error("Movie file was not created.")
                 else:
@@ -1,17 +1,126 @@
 import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from proglog import ProgressBarLogger
 import streamlit as st
 
+# directory -> names in it, and search path -> memoized name -> path, each
+# keeping the ASSET_INDEX_MAX_ENTRIES most recently used entries
+ASSET_INDEX_MAX_ENTRIES = 256
+_directory_index = OrderedDict()
+_search_path_index = OrderedDict()
+_index_lock = threading.Lock()
+
+def _index_entry(index, key, build):
+    """Return index[key], built by build() on a miss, evicting the least recently used."""
+    with _index_lock:
+        if key in index:
+            index.move_to_end(key)
+            return index[key]
+    value = build()
+    with _index_lock:
+        value = index.setdefault(key, value)
+        while len(index) > ASSET_INDEX_MAX_ENTRIES:
+            index.popitem(last=False)
+    return value
+
+def _directory_names(directory):
+    def build():
+        try:
+            return frozenset(os.listdir(directory))
+        except OSError:
+            return frozenset()
+    return _index_entry(_directory_index, directory, build)
+
+def invalidate_asset_index(directory=None):
+    """Forget the indexed contents of directory (or of every directory).
+
+    Call it whenever files are added to a directory that may already have
+    been searched by get_asset_path.
+    """
+    with _index_lock:
+        if directory is None:
+            _directory_index.clear()
+            _search_path_index.clear()
+            return
+        directory = str(directory)
+        _directory_index.pop(directory, None)
+        for search_path in list(_search_path_index):
+            if directory in search_path.split(','):
+                _search_path_index.pop(search_path, None)
+
 def get_asset_path(dir, path):
     if path.startswith('/'):
         return path
+    index = _index_entry(_search_path_index, dir, dict)
+    if path in index:
+        return index[path]
     search_paths = dir.split(',')
     for search_path in search_paths:
-        if Path(search_path).joinpath(path).exists():
-            return Path(search_path).joinpath(path)
+        if '/' in path:
+            found = Path(search_path).joinpath(path).exists()
+        else:
+            found = path in _directory_names(search_path)
+        if found:
+            index[path] = Path(search_path).joinpath(path)
+            return index[path]
     raise Exception(f'Asset not found: {path}')
 
+def _nbytes(value):
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+class AssetCache:
+    """Memory bounded cache of decoded assets shared by a whole run.
+
+    Entries are keyed on the asset's path, mtime and size plus a variant
+    (e.g. the size it was resized to) and the least recently used ones are
+    evicted once the decoded arrays exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, variant, loader):
+        """Return loader()'s result for path, decoding only on a miss."""
+        stat = os.stat(path)
+        key = (str(path), stat.st_mtime_ns, stat.st_size, variant)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            self.misses += 1
+        value = loader()
+        size = _nbytes(value)
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.bytes -= evicted
+        return value
+
+    def count(self, hits=0, misses=0):
+        """Add lookups made by the caches of other processes."""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries), 'bytes': self.bytes}
+
 class MoviePyProgressLogger(ProgressBarLogger):
     def __init__(self, progress_bar, text='Processing video: '):
         super().__init__()
@@ -29,3 +138,14 @@ class MoviePyProgressLogger(ProgressBarLogger):
             if total > 0:
                 percentage = int((index / total) * 100)
                 self.progress_bar.progress(percentage, text=f"{self.text}: {percentage}%")
+
+class QueueProgressLogger(ProgressBarLogger):
+    """Forward frame progress of a worker process to the parent through a queue."""
+    def __init__(self, queue, key):
+        super().__init__()
+        self.queue = queue
+        self.key = key
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == 'frame_index' and attr in ('index', 'total'):
+            self.queue.put((self.key, attr, value))